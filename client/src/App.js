@@ -98,6 +98,52 @@ const ListComponent = ({ selectedOptions }) => {
   );
 };
 
+// Decodes a /preview or /bundle payload: a uint32 header length, the JSON
+// header and one array per band, into a georaster per band name. Quantized
+// bands are scaled back to their values.
+const arrayTypes = {
+  float32: Float32Array,
+  uint8: Uint8Array,
+  uint16: Uint16Array,
+};
+
+const parseBands = async (arrayBuffer) => {
+  const headerLength = new DataView(arrayBuffer).getUint32(0, true);
+  const header = JSON.parse(
+    new TextDecoder().decode(new Uint8Array(arrayBuffer, 4, headerLength))
+  );
+  const ArrayType = arrayTypes[header.dtype];
+  const size = header.width * header.height;
+  const [west, south, east, north] = header.bounds;
+  const metadata = {
+    noDataValue: NaN,
+    projection: parseInt(header.crs.split(':')[1], 10),
+    xmin: west,
+    ymax: north,
+    pixelWidth: (east - west) / header.width,
+    pixelHeight: (north - south) / header.height,
+  };
+
+  let offset = 4 + headerLength;
+  const georasters = {};
+  for (const band of header.bands) {
+    const raw = new ArrayType(arrayBuffer, offset, size);
+    offset += size * ArrayType.BYTES_PER_ELEMENT;
+
+    const data = new Float32Array(size);
+    for (let i = 0; i < size; i++) {
+      data[i] =
+        raw[i] === band.nodata ? NaN : band.offset + raw[i] * band.scale;
+    }
+    const rows = [];
+    for (let row = 0; row < header.height; row++) {
+      rows.push(data.subarray(row * header.width, (row + 1) * header.width));
+    }
+    georasters[band.name] = await parseGeoRaster([rows], metadata);
+  }
+  return georasters;
+};
+
 const CityZoom = ({ selectedCity }) => {
   const map = useMap();
   useEffect(() => {
@@ -124,9 +170,12 @@ function App() {
   const [selectedCity, setSelectedCity] = useState('riyadh');
   const [dataExists, setDataExists] = useState(false);
   const [loading, setLoading] = useState(false);
+  const [catalog, setCatalog] = useState(null);
   // const [stats, setStats] = useState(null);
   const mapRef = useRef();
   const currentLayerRef = useRef(null);
+  // Downsampled weeks of the selected city and analysis, for the slider
+  const bundleRef = useRef({ key: null, georasters: {} });
 
   const handleRadioChange = (event) => {
     setSelectedOptions(event.target.value);
@@ -154,7 +203,57 @@ function App() {
     return days.reverse();
   };
 
-  const weekDates = getDates();
+  // Weeks that exist for the selected city and analysis, from the server's
+  // catalog; the fixed dates are only used until it has loaded
+  const cityCatalog = catalog && catalog.cities[selectedCity];
+  const weekDates =
+    (cityCatalog && cityCatalog.analyses[selectedOptions]) || getDates();
+
+  useEffect(() => {
+    const loadCatalog = async () => {
+      try {
+        const response = await fetch('http://localhost:8000/catalog');
+        if (response.ok) {
+          setCatalog(await response.json());
+        }
+      } catch (error) {
+        console.error('Error loading catalog:', error);
+      }
+    };
+
+    loadCatalog();
+  }, []);
+
+  useEffect(() => {
+    // Every week comes in one request, so moving the slider can draw the
+    // next week straight away while its full image loads
+    const key = `${selectedCity}/${selectedOptions}`;
+    bundleRef.current = { key, georasters: {} };
+
+    const loadBundle = async () => {
+      try {
+        const response = await fetch(
+          `http://localhost:8000/bundle/${key}?width=512&height=512`
+        );
+        if (response.ok) {
+          const georasters = await parseBands(await response.arrayBuffer());
+          if (bundleRef.current.key === key) {
+            bundleRef.current = { key, georasters };
+          }
+        }
+      } catch (error) {
+        console.error('Error loading bundle:', error);
+      }
+    };
+
+    loadBundle();
+  }, [selectedCity, selectedOptions, catalog]);
+
+  useEffect(() => {
+    if (selectedTime > weekDates.length - 1) {
+      setSelectedTime(Math.max(weekDates.length - 1, 0));
+    }
+  }, [selectedTime, weekDates.length]);
 
   useEffect(() => {
     const loadGeoTIFF = async () => {
@@ -239,6 +338,7 @@ function App() {
       };
       const selectedDate = weekDates[selectedTime];
       const tiffUrl = `http://localhost:8000/tiles/${selectedCity}/${selectedDate}/${selectedOptions}/image.tif`;
+      const previewUrl = `http://localhost:8000/preview/${selectedCity}/${selectedDate}/${selectedOptions}?width=1024&height=1024`;
 
       setLoading(true);
 
@@ -247,28 +347,46 @@ function App() {
         currentLayerRef.current = null;
       }
 
+      const showGeoRaster = (georaster) => {
+        const layer = new GeoRasterLayer({
+          georaster: georaster,
+          opacity: 0.9,
+          resolution: 256,
+          pixelValuesToColorFn: palettes[selectedOptions].color,
+        });
+
+        if (mapRef.current) {
+          // Clear previous layer
+          if (currentLayerRef.current) {
+            mapRef.current.removeLayer(currentLayerRef.current);
+          }
+
+          layer.addTo(mapRef.current);
+          currentLayerRef.current = layer;
+        }
+      };
+
       try {
+        // A downsampled week is drawn first, from the bundle when it has
+        // loaded, then replaced by the full resolution image
+        const bundled = bundleRef.current.georasters[selectedDate];
+        if (bundled) {
+          showGeoRaster(bundled);
+        } else {
+          const previewResponse = await fetch(previewUrl);
+          if (previewResponse.status === 200) {
+            const georasters = await parseBands(
+              await previewResponse.arrayBuffer()
+            );
+            showGeoRaster(georasters[selectedOptions]);
+          }
+        }
+
         const response = await fetch(tiffUrl);
         setDataExists(response.status === 200);
         if (response.status === 200) {
           const arrayBuffer = await response.arrayBuffer();
-          const georaster = await parseGeoRaster(arrayBuffer);
-          const layer = new GeoRasterLayer({
-            georaster: georaster,
-            opacity: 0.9,
-            resolution: 256,
-            pixelValuesToColorFn: palettes[selectedOptions].color,
-          });
-
-          if (mapRef.current) {
-            // Clear previous layer
-            if (currentLayerRef.current) {
-              mapRef.current.removeLayer(currentLayerRef.current);
-            }
-
-            layer.addTo(mapRef.current);
-            currentLayerRef.current = layer;
-          }
+          showGeoRaster(await parseGeoRaster(arrayBuffer));
         } else {
           console.warn(
             `GeoTIFF file not found for ${selectedCity}, ${selectedDate}, ${selectedOptions}`
@@ -295,7 +413,7 @@ function App() {
 
     loadGeoTIFF();
     // fetchStats();
-  }, [selectedTime, selectedOptions, selectedCity]);
+  }, [selectedTime, selectedOptions, selectedCity, catalog]);
 
   return (
     <div className="app">
@@ -313,7 +431,15 @@ function App() {
               value={selectedCity}
               onChange={handleCityChange}
             >
-              <option value="riyadh">Riyadh</option>
+              {catalog ? (
+                Object.keys(catalog.cities).map((city) => (
+                  <option value={city} key={city}>
+                    {city}
+                  </option>
+                ))
+              ) : (
+                <option value="riyadh">Riyadh</option>
+              )}
             </select>
 
             <div className="app__status d-inline-block w-auto m-2">
@@ -0,0 +1,148 @@
+import os
+import glob
+import time
+import threading
+import rasterio
+from rasterio.errors import RasterioIOError
+from rasterio.warp import transform_bounds
+
+
+def read_bounds(path):
+    # (west, south, east, north) of an image in degrees
+    with rasterio.open(path) as src:
+        return transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+
+
+class Catalog:
+    # In-memory index of every <city>/<date>/<analysis>/image.tif under
+    # base_dir, so requests can check what exists and get its mtime without
+    # touching the filesystem. The tree is rescanned at most once per
+    # refresh_interval seconds; update_file and remove_file apply single
+    # changes. Each city also records the bounds of its first readable image,
+    # for the client to zoom to.
+
+    def __init__(self, base_dir, refresh_interval=30):
+        self.base_dir = base_dir
+        self.refresh_interval = refresh_interval
+        self._files = {}
+        self._mtimes = {}
+        self._city_images = {}
+        self._bounds = {}
+        self._last_refresh = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        self._last_refresh = time.monotonic()
+        pattern = os.path.join(self.base_dir, "*", "*", "*", "image.tif")
+        seen = set()
+        changed = False
+
+        for path in glob.glob(pattern):
+            seen.add(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            cached = self._files.get(path)
+            if cached is not None and self._mtimes.get(cached) == mtime:
+                continue
+            self.update_file(path, mtime)
+            changed = True
+
+        for path in set(self._files) - seen:
+            self.remove_file(path)
+            changed = True
+
+        return changed
+
+    def _key(self, path):
+        rel_path = os.path.relpath(path, self.base_dir)
+        city, date, analysis, _ = rel_path.split(os.sep)
+        return city.lower(), date, analysis
+
+    def update_file(self, path, mtime=None):
+        key = self._key(path)
+        try:
+            mtime = mtime or os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            self.remove_file(path)
+            return
+
+        city = key[0]
+        bounds = None
+        if city not in self._bounds:
+            try:
+                bounds = read_bounds(path)
+            except (RasterioIOError, ValueError) as e:
+                print(f"Could not read bounds of {path}: {e}")
+
+        with self._lock:
+            if key not in self._mtimes:
+                self._city_images[city] = self._city_images.get(city, 0) + 1
+            self._files[path] = key
+            self._mtimes[key] = mtime
+            if bounds is not None:
+                self._bounds.setdefault(city, bounds)
+
+    def remove_file(self, path):
+        with self._lock:
+            key = self._files.pop(path, None)
+            if key is None:
+                return
+            self._mtimes.pop(key, None)
+            city = key[0]
+            self._city_images[city] -= 1
+            if not self._city_images[city]:
+                del self._city_images[city]
+                self._bounds.pop(city, None)
+
+    def maybe_refresh(self):
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+
+    def has_city(self, city):
+        self.maybe_refresh()
+        return city in self._city_images
+
+    def image_mtime(self, city, date, analysis):
+        # mtime_ns of the image, or None when it does not exist
+        self.maybe_refresh()
+        return self._mtimes.get((city, date, analysis))
+
+    def weeks(self, city, analysis):
+        # Sorted [(date, mtime_ns)] of every image of an analysis
+        self.maybe_refresh()
+        with self._lock:
+            return sorted(
+                (date, mtime)
+                for (image_city, date, image_analysis), mtime in self._mtimes.items()
+                if image_city == city and image_analysis == analysis
+            )
+
+    def to_dict(self):
+        # {"cities": {city: {"bounds", "center", "dates", "analyses"}}} with
+        # the sorted weeks of every analysis
+        self.maybe_refresh()
+        with self._lock:
+            keys = sorted(self._mtimes)
+            bounds = dict(self._bounds)
+
+        cities = {}
+        for city, date, analysis in keys:
+            entry = cities.setdefault(city, {"dates": [], "analyses": {}})
+            if not entry["dates"] or entry["dates"][-1] != date:
+                entry["dates"].append(date)
+            entry["analyses"].setdefault(analysis, []).append(date)
+
+        for city, entry in cities.items():
+            city_bounds = bounds.get(city)
+            entry["bounds"] = list(city_bounds) if city_bounds else None
+            entry["center"] = (
+                [
+                    (city_bounds[1] + city_bounds[3]) / 2,
+                    (city_bounds[0] + city_bounds[2]) / 2,
+                ]
+                if city_bounds
+                else None
+            )
+        return {"cities": cities}
@@ -0,0 +1,108 @@
+import os
+import glob
+import argparse
+import rasterio
+from rasterio.errors import RasterioIOError
+from rasterio.shutil import copy as rio_copy
+from dotenv import load_dotenv
+
+from palettes import categorical
+
+load_dotenv()
+
+data_folder = os.getenv("DATAPATH", "data")
+cog_blocksize = int(os.getenv("COG_BLOCKSIZE", 512))
+
+
+def is_cog(tif_file_path):
+    with rasterio.open(tif_file_path) as src:
+        if not src.profile.get("tiled"):
+            return False
+        # Rasters that fit in a single block do not need overviews
+        if max(src.width, src.height) <= cog_blocksize:
+            return True
+        return bool(src.overviews(1))
+
+
+def convert_to_cog(src_path, dst_path=None):
+    # Write the COG next to its destination and rename it into place, so a
+    # reader never sees a partially written image.tif
+    dst_path = dst_path or src_path
+    tmp_path = f"{dst_path}.cog.tmp"
+    analysis = os.path.basename(os.path.dirname(dst_path))
+    overview_resampling = "nearest" if analysis in categorical else "average"
+
+    try:
+        with rasterio.open(src_path) as src:
+            rio_copy(
+                src,
+                tmp_path,
+                driver="COG",
+                compress="DEFLATE",
+                predictor="YES",
+                blocksize=cog_blocksize,
+                overview_resampling=overview_resampling,
+            )
+        os.replace(tmp_path, dst_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    print(f"Converted {src_path} to COG at {dst_path}")
+
+
+def split_bands(src_path, dst_paths):
+    # Write band i of a multi-band export as a single-band COG at dst_paths[i]
+    with rasterio.open(src_path) as src:
+        if src.count != len(dst_paths):
+            raise ValueError(
+                f"{src_path} has {src.count} bands, expected {len(dst_paths)}"
+            )
+        profile = src.profile
+        profile.update(count=1, driver="GTiff")
+        profile.pop("photometric", None)
+
+        for band, dst_path in enumerate(dst_paths, start=1):
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            band_path = f"{dst_path}.band.tmp"
+            try:
+                with rasterio.open(band_path, "w", **profile) as dst:
+                    dst.write(src.read(band), 1)
+                convert_to_cog(band_path, dst_path)
+            finally:
+                if os.path.exists(band_path):
+                    os.remove(band_path)
+
+
+def convert_folder(folder, force=False):
+    pattern = os.path.join(folder, "*", "*", "*", "image.tif")
+    for tif_file in sorted(glob.glob(pattern)):
+        try:
+            if not force and is_cog(tif_file):
+                continue
+            convert_to_cog(tif_file)
+        except RasterioIOError as e:
+            print(f"Failed to convert {tif_file}: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rewrite downloaded GeoTIFFs as Cloud-Optimized GeoTIFFs."
+    )
+    parser.add_argument(
+        "--folder",
+        type=str,
+        default=data_folder,
+        help="Data folder laid out as <city>/<week>/<analysis>/image.tif.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Convert files that are already COGs.",
+    )
+    args = parser.parse_args()
+    convert_folder(args.folder, args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+import os
+import re
+import glob
+import math
+import argparse
+import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from rasterio.windows import Window, from_bounds
+from dotenv import load_dotenv
+
+from cog import convert_to_cog
+from gee.job_config import jobs_config_path, load_job_config, period_end
+from gee.planner import plan_week_dates
+from indices import compute_index, indices, required_bands
+
+# Local weekly composites from downloaded scenes, as an alternative to the
+# Earth Engine exports. A scene is a folder with one GeoTIFF per band, named
+# after the Earth Engine band (B4.tif, QA60.tif, ...) or ending in it like
+# Landsat's LC08_..._ST_B10.TIF, and with the acquisition date in the folder
+# name. Every band is read through a WarpedVRT onto one output grid, block by
+# block. Each block keeps running accumulators that the scenes covering it
+# are streamed into one at a time, and at most max_blocks blocks are being
+# composited or waiting to be written at once, so memory stays bounded by the
+# block size whatever the size of the mosaic, e.g.
+#
+#     python composite.py --analysis ndvi --city riyadh --scenes scenes/s2/*
+#
+# Scenes are grouped into the same weeks as the GEE exports of jobs.json, so
+# a local composite covers the same days as the export it stands in for and
+# is written to the same <city>/<week> folder.
+
+load_dotenv()
+
+data_folder = os.getenv("DATAPATH", "data")
+composite_block_size = int(os.getenv("COMPOSITE_BLOCK_SIZE", 512))
+composite_max_blocks = int(os.getenv("COMPOSITE_MAX_BLOCKS", os.cpu_count() or 1))
+median_sample_size = int(os.getenv("COMPOSITE_MEDIAN_SAMPLE", 16))
+
+scene_date_pattern = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})")
+
+
+def scene_date(scene_dir):
+    match = scene_date_pattern.search(os.path.basename(os.path.normpath(scene_dir)))
+    if not match:
+        raise ValueError(f"No acquisition date in scene folder name {scene_dir}")
+    return datetime.date(*map(int, match.groups()))
+
+
+def week_start_for(date):
+    # Weeks start on Sunday, like the folders download.py files exports into
+    return date - datetime.timedelta(days=(date.weekday() + 1) % 7)
+
+
+def find_band_file(scene_dir, band):
+    for path in sorted(glob.glob(os.path.join(scene_dir, "*"))):
+        stem, ext = os.path.splitext(os.path.basename(path))
+        if ext.lower() not in (".tif", ".tiff"):
+            continue
+        if stem.upper() == band or stem.upper().endswith(f"_{band}"):
+            return path
+    raise FileNotFoundError(f"No {band} band in scene {scene_dir}")
+
+
+def export_weeks(config):
+    # (start, end) of every week the GEE scripts export for the period of
+    # config. The end is exclusive as in filterDate, so like the exports a
+    # week leaves out its sixth day after the start.
+    return [
+        (datetime.date.fromisoformat(start), datetime.date.fromisoformat(end))
+        for start, end in plan_week_dates(period_end(config), config["months"])
+    ]
+
+
+def group_scenes_by_week(scene_dirs, week_dates):
+    # {folder date: scene folders}. A week is filed under the Sunday on or
+    # before its start, as download.py files the export of that week.
+    weeks = {}
+    for scene_dir in scene_dirs:
+        date = scene_date(scene_dir)
+        for start, end in week_dates:
+            if start <= date < end:
+                weeks.setdefault(week_start_for(start), []).append(scene_dir)
+                break
+        else:
+            print(f"Skipping {scene_dir}, outside the exported weeks")
+    return dict(sorted(weeks.items()))
+
+
+def reference_grid(path):
+    with rasterio.open(path) as src:
+        return {
+            "crs": src.crs,
+            "transform": src.transform,
+            "width": src.width,
+            "height": src.height,
+        }
+
+
+def mosaic_grid(paths):
+    # Grid covering every scene, in the CRS and resolution of the first
+    with rasterio.open(paths[0]) as src:
+        crs = src.crs
+        xres, yres = src.res
+
+    lefts, bottoms, rights, tops = [], [], [], []
+    for path in paths:
+        with rasterio.open(path) as src:
+            left, bottom, right, top = transform_bounds(src.crs, crs, *src.bounds)
+        lefts.append(left)
+        bottoms.append(bottom)
+        rights.append(right)
+        tops.append(top)
+
+    left, top = min(lefts), max(tops)
+    return {
+        "crs": crs,
+        "transform": from_origin(left, top, xres, yres),
+        "width": math.ceil((max(rights) - left) / xres),
+        "height": math.ceil((top - min(bottoms)) / yres),
+    }
+
+
+def scene_footprint(path, grid):
+    # (col_start, row_start, col_stop, row_stop) of a scene on the grid
+    with rasterio.open(path) as src:
+        bounds = transform_bounds(src.crs, grid["crs"], *src.bounds)
+    window = from_bounds(*bounds, transform=grid["transform"])
+    return (
+        window.col_off,
+        window.row_off,
+        window.col_off + window.width,
+        window.row_off + window.height,
+    )
+
+
+def overlaps(footprint, window):
+    col_start, row_start, col_stop, row_stop = footprint
+    return (
+        col_start < window.col_off + window.width
+        and col_stop > window.col_off
+        and row_start < window.row_off + window.height
+        and row_stop > window.row_off
+    )
+
+
+def iter_windows(width, height, block_size):
+    for row in range(0, height, block_size):
+        for col in range(0, width, block_size):
+            yield Window(
+                col, row, min(block_size, width - col), min(block_size, height - row)
+            )
+
+
+class AlignedScene:
+    # All bands of one scene warped onto the output grid. Nearest resampling,
+    # like Earth Engine's default, keeps the QA bits intact.
+
+    def __init__(self, scene_dir, bands, grid):
+        self.scene_dir = scene_dir
+        self.sources = []
+        self.bands = {}
+        for band in bands:
+            src = rasterio.open(find_band_file(scene_dir, band))
+            self.sources.append(src)
+            self.bands[band] = WarpedVRT(
+                src, resampling=Resampling.nearest, add_alpha=True, **grid
+            )
+
+    def read(self, window):
+        return {
+            band: vrt.read(1, window=window, masked=True)
+            .astype(np.float32)
+            .filled(np.nan)
+            for band, vrt in self.bands.items()
+        }
+
+    def close(self):
+        for vrt in self.bands.values():
+            vrt.close()
+        for src in self.sources:
+            src.close()
+
+
+class RunningMean:
+    # Per-pixel sum and count of the scenes that have a value
+
+    def __init__(self, shape, seed=None):
+        self.total = np.zeros(shape, dtype=np.float64)
+        self.count = np.zeros(shape, dtype=np.uint32)
+
+    def add(self, values):
+        valid = ~np.isnan(values)
+        self.total[valid] += values[valid]
+        self.count += valid
+
+    def result(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self.total / self.count
+        return np.where(self.count > 0, mean, np.nan).astype(np.float32)
+
+
+class ReservoirMedian:
+    # Approximate per-pixel median: a uniform reservoir sample of at most
+    # sample_size values per pixel (Algorithm R), exact while no pixel has
+    # more valid scenes than that
+
+    def __init__(self, shape, seed=None, sample_size=median_sample_size):
+        self.sample = np.full((sample_size, *shape), np.nan, dtype=np.float32)
+        self.seen = np.zeros(shape, dtype=np.int64)
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, values):
+        valid = ~np.isnan(values)
+        sample_size = len(self.sample)
+        slot = np.where(
+            self.seen < sample_size,
+            self.seen,
+            self.rng.integers(0, self.seen + 1),
+        )
+        keep = valid & (slot < sample_size)
+        rows, cols = np.nonzero(keep)
+        self.sample[slot[keep], rows, cols] = values[keep]
+        self.seen += valid
+
+    def result(self):
+        median = np.full(self.seen.shape, np.nan, dtype=np.float32)
+        has_values = self.seen > 0
+        median[has_values] = np.nanmedian(self.sample[:, has_values], axis=0)
+        return median
+
+
+reducers = {"mean": RunningMean, "median": ReservoirMedian}
+
+
+def composite_block(analysis, scenes, bands, grid, window, statistic):
+    # scenes is a list of (scene_dir, footprint); a scene is only opened for
+    # the blocks it covers, and only one of its windows is read at a time
+    reducer = reducers[statistic](
+        (int(window.height), int(window.width)),
+        seed=(int(window.row_off), int(window.col_off)),
+    )
+    for scene_dir, footprint in scenes:
+        if not overlaps(footprint, window):
+            continue
+        scene = AlignedScene(scene_dir, bands, grid)
+        try:
+            reducer.add(compute_index(analysis, scene.read(window)))
+        finally:
+            scene.close()
+    return reducer.result()
+
+
+def iter_bounded(executor, function, items, max_pending):
+    # Results in order, with at most max_pending submitted and not yet
+    # consumed
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(function, item)))
+        if len(pending) >= max_pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def build_weekly_composite(analysis, scene_dirs, destination, like=None,
+                           block_size=composite_block_size,
+                           max_blocks=composite_max_blocks, statistic="mean"):
+    bands = required_bands(analysis)
+    band_files = [find_band_file(scene_dir, bands[0]) for scene_dir in scene_dirs]
+    grid = reference_grid(like) if like else mosaic_grid(band_files)
+    scenes = [
+        (scene_dir, scene_footprint(band_file, grid))
+        for scene_dir, band_file in zip(scene_dirs, band_files)
+    ]
+    profile = {
+        "driver": "GTiff",
+        "dtype": "float32",
+        "count": 1,
+        "nodata": np.nan,
+        "tiled": True,
+        "blockxsize": block_size,
+        "blockysize": block_size,
+        "bigtiff": "IF_SAFER",
+        **grid,
+    }
+
+    def compose(window):
+        return composite_block(analysis, scenes, bands, grid, window, statistic)
+
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    tmp_path = f"{destination}.composite.tmp"
+    try:
+        windows = iter_windows(grid["width"], grid["height"], block_size)
+        with rasterio.open(tmp_path, "w", **profile) as dst, \
+                ThreadPoolExecutor(max_workers=max_blocks) as executor:
+            for window, block in iter_bounded(executor, compose, windows, max_blocks):
+                dst.write(block, 1, window=window)
+        convert_to_cog(tmp_path, destination)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build weekly mean composites from local scenes."
+    )
+    parser.add_argument("--analysis", required=True, choices=sorted(indices))
+    parser.add_argument("--city", required=True, help="City folder name, e.g. riyadh.")
+    parser.add_argument(
+        "--scenes",
+        nargs="+",
+        required=True,
+        help="Scene folders, each holding one GeoTIFF per band.",
+    )
+    parser.add_argument(
+        "--week",
+        type=str,
+        default=None,
+        help="Only build the week filed under this folder date (YYYY-MM-DD).",
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=jobs_config_path,
+        help="Jobs file whose period sets the weeks, as for the GEE exports.",
+    )
+    parser.add_argument(
+        "--like",
+        type=str,
+        default=None,
+        help="Raster whose grid the composite is written on "
+        "(default: a grid covering every scene).",
+    )
+    parser.add_argument("--block-size", type=int, default=composite_block_size)
+    parser.add_argument(
+        "--max-blocks",
+        type=int,
+        default=composite_max_blocks,
+        help="Blocks composited or buffered at once; bounds memory use.",
+    )
+    parser.add_argument(
+        "--statistic",
+        choices=sorted(reducers),
+        default="mean",
+        help="Per-pixel statistic; median is approximated from a reservoir "
+        f"sample of COMPOSITE_MEDIAN_SAMPLE ({median_sample_size}) values.",
+    )
+    parser.add_argument("--folder", type=str, default=data_folder)
+    args = parser.parse_args()
+
+    weeks = group_scenes_by_week(args.scenes, export_weeks(load_job_config(args.config)))
+    if args.week:
+        week = datetime.date.fromisoformat(args.week)
+        weeks = {week: weeks.get(week, [])}
+
+    for week, scene_dirs in weeks.items():
+        if not scene_dirs:
+            print(f"No scenes for week {week}")
+            continue
+        destination = os.path.join(
+            args.folder, args.city, week.isoformat(), args.analysis, "image.tif"
+        )
+        print(f"Compositing {len(scene_dirs)} scenes into {destination}")
+        build_weekly_composite(
+            args.analysis,
+            scene_dirs,
+            destination,
+            args.like,
+            args.block_size,
+            args.max_blocks,
+            args.statistic,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,26 @@
 import os
+import shutil
 import datetime
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from googleapiclient.discovery import build
 from google.oauth2 import service_account
+from google.auth.transport.requests import AuthorizedSession
 from dotenv import load_dotenv
-import requests
+from requests.adapters import HTTPAdapter
+from rasterio.errors import RasterioIOError
+
+from cog import convert_to_cog, split_bands
+from gee.export_driver import load_completed_exports
+from manifest import (
+    file_md5,
+    get_last_sync,
+    needs_sync,
+    open_manifest,
+    record_file,
+    set_last_sync,
+    utc_now,
+)
 
 load_dotenv()
 
@@ -12,6 +28,9 @@ load_dotenv()
 credentials_path = os.getenv("GOOGLE_CREDENTIALS_PATH")
 folder_id = os.getenv("FOLDER_ID")
 data_folder = os.getenv("DATAPATH", "data")
+manifest_path = os.getenv("MANIFEST_PATH", "download_manifest.sqlite")
+download_workers = int(os.getenv("DOWNLOAD_WORKERS", 8))
+chunk_size = 1024 * 1024
 
 if not credentials_path or not os.path.exists(credentials_path):
     raise Exception("Google credentials file path not found in environment variables.")
@@ -22,32 +41,177 @@ credentials = service_account.Credentials.from_service_account_file(
 
 service = build("drive", "v3", credentials=credentials)
 
+analysis_types = ["um", "radiance", "lst", "uhi", "ndvi", "ndbi", "albedo"]
+# Multi-band exports and the analysis stored in each band, in band order. The
+# order must match S2_INDICES in gee/s2_indices.py.
+multiband_analyses = {"s2": ["ndvi", "ndbi", "albedo"]}
+# Analyses exported once per period by gee/urbanmask.py, as
+# <city>_<analysis>_<first week>_<last week>, and linked into every week
+period_analyses = {"um", "radiance"}
+
+
+def create_session(pool_size):
+    # One pooled, authorized session shared by all download threads
+    session = AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    return session
+
+
+def list_files_in_folder(folder_id, modified_after=None):
+    query = f"'{folder_id}' in parents and trashed = false"
+    if modified_after:
+        query += f" and modifiedTime > '{modified_after}'"
+    fields = "nextPageToken, files(id, name, size, md5Checksum, modifiedTime)"
+    items = []
+    page_token = None
+    while True:
+        results = (
+            service.files()
+            .list(q=query, fields=fields, pageSize=1000, pageToken=page_token)
+            .execute()
+        )
+        items.extend(results.get("files", []))
+        page_token = results.get("nextPageToken")
+        if not page_token:
+            break
 
-def list_files_in_folder(folder_id):
-    query = f"'{folder_id}' in parents"
-    results = service.files().list(q=query, fields="files(id, name)").execute()
-    items = results.get("files", [])
     if not items:
         print("No files found.")
-    else:
-        return items
+    return items
 
 
 def get_current_date():
     return datetime.datetime.now().strftime("%Y-%m-%d")
 
 
-def download_file(file_id, destination):
-    download_url = f"https://drive.google.com/uc?id={file_id}"
-    response = requests.get(download_url, stream=True)
-    if response.status_code == 200:
-        with open(destination, "wb") as f:
-            for chunk in response.iter_content(chunk_size=1024):
+def verify_download(item, path):
+    expected_size = item.get("size")
+    if expected_size is not None and os.path.getsize(path) != int(expected_size):
+        print(f"Size mismatch for {item['name']}.")
+        return False
+
+    expected_md5 = item.get("md5Checksum")
+    if expected_md5 is not None and file_md5(path) != expected_md5:
+        print(f"Checksum mismatch for {item['name']}.")
+        return False
+    return True
+
+
+def download_file(session, item, destination):
+    # Download next to the destination and only move it into place once
+    # complete, so the server never serves a half-written file. A .part file
+    # left by an interrupted run is resumed with a Range request.
+    download_url = f"https://www.googleapis.com/drive/v3/files/{item['id']}?alt=media"
+    partial_path = f"{destination}.part"
+    offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    expected_size = int(item["size"]) if "size" in item else None
+
+    if expected_size is not None and offset > expected_size:
+        os.remove(partial_path)
+        offset = 0
+
+    if not offset or offset != expected_size:
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        response = session.get(download_url, headers=headers, stream=True)
+        if response.status_code == 416:
+            # The server cannot resume from this offset; start over
+            os.remove(partial_path)
+            return download_file(session, item, destination)
+        if response.status_code not in (200, 206):
+            print(f"Failed to download the file. Status code: {response.status_code}")
+            return False
+
+        mode = "ab" if response.status_code == 206 else "wb"
+        with open(partial_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
                 if chunk:
                     f.write(chunk)
-        print(f"Downloaded file to {destination}")
-    else:
-        print(f"Failed to download the file. Status code: {response.status_code}")
+
+    if not verify_download(item, partial_path):
+        os.remove(partial_path)
+        return False
+
+    if not finalize_download(partial_path, destination):
+        return False
+    print(f"Downloaded file to {destination}")
+    return True
+
+
+def band_destinations(destination, analysis):
+    # Sibling <analysis>/image.tif of every band of a multi-band export
+    date_folder = os.path.dirname(os.path.dirname(destination))
+    return [
+        os.path.join(date_folder, band_analysis, "image.tif")
+        for band_analysis in multiband_analyses[analysis]
+    ]
+
+
+def is_period_destination(destination):
+    parts = os.path.normpath(destination).split(os.sep)
+    return len(parts) >= 4 and parts[-4] == "periods"
+
+
+def period_destinations(destination):
+    # <week>/<analysis>/image.tif of every week of a period export stored at
+    # <city>/periods/<first week>_<last week>/<analysis>/image.tif
+    analysis_folder = os.path.dirname(destination)
+    period_folder = os.path.dirname(analysis_folder)
+    city_folder = os.path.dirname(os.path.dirname(period_folder))
+    first, last = (
+        datetime.date.fromisoformat(date)
+        for date in os.path.basename(period_folder).split("_")
+    )
+    destinations = []
+    week = first
+    while week <= last:
+        week_folder = get_first_day_of_week_for_date(week).strftime("%Y-%m-%d")
+        destinations.append(
+            os.path.join(
+                city_folder, week_folder, os.path.basename(analysis_folder), "image.tif"
+            )
+        )
+        week += datetime.timedelta(days=7)
+    return destinations
+
+
+def link_period(destination):
+    # Hard links share the one downloaded file between the weeks; a copy is
+    # made where the data folder does not support them
+    for week_destination in period_destinations(destination):
+        os.makedirs(os.path.dirname(week_destination), exist_ok=True)
+        tmp_path = f"{week_destination}.link"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(destination, tmp_path)
+        except OSError:
+            shutil.copyfile(destination, tmp_path)
+        os.replace(tmp_path, week_destination)
+
+
+def finalize_download(partial_path, destination):
+    if not destination.endswith(".tif"):
+        os.replace(partial_path, destination)
+        return True
+
+    analysis = os.path.basename(os.path.dirname(destination))
+    try:
+        if analysis in multiband_analyses:
+            # Keep the composite for change detection, serve the bands
+            split_bands(partial_path, band_destinations(destination, analysis))
+            os.replace(partial_path, destination)
+        else:
+            convert_to_cog(partial_path, destination)
+            if is_period_destination(destination):
+                link_period(destination)
+        return True
+    except (RasterioIOError, ValueError) as e:
+        print(f"Failed to convert {partial_path} to COG: {e}")
+        return False
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
 
 
 def get_first_day_of_week_for_date(date):
@@ -58,52 +222,90 @@ def get_first_day_of_week_for_date(date):
     return date - datetime.timedelta(days=sunday_index)
 
 
-def download_and_process_files(analysis_type):
-    current_date = get_current_date()
-    files = list_files_in_folder(folder_id)
-    if not os.path.exists(data_folder):
-        os.makedirs(data_folder)
+def get_destination(item):
+    # Drive exports are named <city>_<analysis>_<date>.<ext>
+    file_name = item["name"]
+    parts = file_name.split("_")
+    if len(parts) < 3:
+        return None, None
+    city = parts[0]
+    analysis = parts[1]
+    if analysis in period_analyses and len(parts) == 4:
+        first = datetime.date.fromisoformat(parts[2]).isoformat()
+        last = datetime.date.fromisoformat(parts[3].split(".")[0]).isoformat()
+        if "tif" not in file_name:
+            return analysis, None
+        return analysis, os.path.join(
+            data_folder, city, "periods", f"{first}_{last}", analysis, "image.tif"
+        )
+    input_date = parts[2].split(".")[0]
+    first_day_of_week = get_first_day_of_week_for_date(input_date)
 
-    for item in files:
-        if analysis_type in item["name"]:
-            print(f"Processing file: {item['name']}")
-            # Enable if you want to process files for current date only
-            # if current_date in item["name"]:
-            file_id = item["id"]
-            file_name = item["name"]
-            parts = file_name.split("_")
-            city = parts[0]
-            analysis = parts[1]
-            input_date = parts[2].split(".")[0]
-            first_day_of_week = get_first_day_of_week_for_date(input_date)
+    first_day_of_week_str = first_day_of_week.strftime("%Y-%m-%d")
+    analysis_folder = os.path.join(data_folder, city, first_day_of_week_str, analysis)
 
-            if analysis != analysis_type:
-                continue
-            city_folder = os.path.join(data_folder, city)
+    if "tif" in file_name:
+        # Multi-band composites are not tiled, so they are not named image.tif
+        if analysis in multiband_analyses:
+            return analysis, os.path.join(analysis_folder, "composite.tif")
+        return analysis, os.path.join(analysis_folder, "image.tif")
+    if "geojson" in file_name:
+        return analysis, os.path.join(analysis_folder, "stats.geojson")
+    return analysis, None
 
-            if not os.path.exists(city_folder):
-                os.makedirs(city_folder)
-            first_day_of_week_str = first_day_of_week.strftime("%Y-%m-%d")
-            date_folder = os.path.join(city_folder, first_day_of_week_str)
 
-            if not os.path.exists(date_folder):
-                os.makedirs(date_folder)
+def download_and_process_files(
+    conn, files, analyses, workers, exports=None, verify=False
+):
+    jobs = []
+    for item in files:
+        # With an export manifest, only fetch the outputs of completed tasks
+        if exports is not None and os.path.splitext(item["name"])[0] not in exports:
+            continue
 
-            analysis_folder = os.path.join(date_folder, analysis)
-            if not os.path.exists(analysis_folder):
-                os.makedirs(analysis_folder)
+        try:
+            analysis, destination = get_destination(item)
+        except ValueError:
+            print(f"Skipping file with unexpected name: {item['name']}")
+            continue
 
+        wanted = analysis in analyses or any(
+            band in analyses for band in multiband_analyses.get(analysis, [])
+        )
+        if not wanted or destination is None:
+            continue
 
-            if 'tif' in file_name:
-                destination = os.path.join(analysis_folder, f"image.tif")
-                
-            if 'geojson' in file_name:
-                destination = os.path.join(analysis_folder, f"stats.geojson")
+        if not needs_sync(conn, item, destination, verify):
+            continue
 
-            if os.path.exists(destination):
-                print(f"File {destination} already exists. Skipping download.")
-            else:
-                download_file(file_id, destination)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        jobs.append((item, destination))
+
+    if not jobs:
+        return []
+
+    session = create_session(workers)
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(download_file, session, item, destination): (
+                item,
+                destination,
+            )
+            for item, destination in jobs
+        }
+        for future in as_completed(futures):
+            item, destination = futures[future]
+            print(f"Processing file: {item['name']}")
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f"Failed to download {item['name']}: {e}")
+                ok = False
+            if ok:
+                record_file(conn, item, destination)
+            results.append((item, destination, ok))
+    return results
 
 
 def main():
@@ -113,14 +315,80 @@ def main():
     parser.add_argument(
         "--analysis",
         type=str,
-        default="um",
-        help="The analysis type to process (default 'um').",
+        default=None,
+        help="The analysis type to process (default: all analysis types).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=download_workers,
+        help="Number of concurrent downloads.",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="List every file in the folder instead of only those modified "
+        "since the last complete sync.",
+    )
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Check the md5 of every local file against the one recorded "
+        "when it was written and fetch the ones that differ. Implies --full.",
+    )
+    parser.add_argument(
+        "--export-manifest",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Export manifests written by the gee/ scripts; only files of "
+        "completed exports are downloaded.",
+    )
+    parser.add_argument(
+        "--changes-file",
+        type=str,
+        default=None,
+        help="Write the local paths updated by this run to this file.",
     )
     args = parser.parse_args()
-    analysis_types = ["um", "lst", "uhi", "ndvi", "ndbi", "albedo"]
-    for analysis in analysis_types:
-        print(f"Processing analysis type: {analysis}")
-        download_and_process_files(analysis)
+    analyses = [args.analysis] if args.analysis else analysis_types
+
+    conn = open_manifest(manifest_path)
+    sync_started = utc_now()
+    # Corrupted local copies of files unchanged on Drive are only found when
+    # every file is listed
+    last_sync = None if args.full or args.verify else get_last_sync(conn)
+
+    # The folder is listed once and shared by every analysis type. After a
+    # complete sync only files modified since then are listed.
+    files = list_files_in_folder(folder_id, modified_after=last_sync)
+    print(f"Processing analysis types: {', '.join(analyses)}")
+    exports = None
+    if args.export_manifest:
+        exports = set()
+        for path in args.export_manifest:
+            exports |= load_completed_exports(path)
+    results = download_and_process_files(
+        conn, files, analyses, args.workers, exports, args.verify
+    )
+
+    changed = sorted(destination for _, destination, ok in results if ok)
+    failed = [item["name"] for item, _, ok in results if not ok]
+    print(f"Downloaded {len(changed)} files, {len(failed)} failed.")
+    for destination in changed:
+        print(f"Updated: {destination}")
+    for name in failed:
+        print(f"Failed: {name}")
+
+    if args.changes_file:
+        with open(args.changes_file, "w") as f:
+            f.writelines(f"{destination}\n" for destination in changed)
+
+    # Failed files must be listed again next run, and a partial run over
+    # one analysis type or one export batch must not hide other changes
+    if not failed and analyses == analysis_types and exports is None:
+        set_last_sync(conn, sync_started)
+    conn.close()
 
 
 if __name__ == "__main__":
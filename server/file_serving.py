@@ -0,0 +1,110 @@
+import os
+import hashlib
+import datetime
+import threading
+
+from fastapi import HTTPException
+
+# Past weeks change only when they are re-exported or retiled, so they are
+# cached longer than the current week. Either way the files are revalidated
+# with their ETag once the max-age is over, so a rewritten week shows up
+# without clearing any cache.
+PAST_WEEK_MAX_AGE = int(os.getenv("PAST_WEEK_MAX_AGE", 3600))
+CURRENT_WEEK_MAX_AGE = int(os.getenv("CURRENT_WEEK_MAX_AGE", 300))
+RANGE_CHUNK_SIZE = 1024 * 1024
+
+media_types = {
+    ".tif": "image/tiff",
+    ".geojson": "application/geo+json",
+    ".json": "application/json",
+    ".png": "image/png",
+}
+
+_etags = {}
+_etags_lock = threading.Lock()
+
+
+def file_etag(path, stat_result):
+    # Content-hash ETag, recomputed only when the file's mtime or size changes
+    key = (stat_result.st_mtime_ns, stat_result.st_size)
+    with _etags_lock:
+        cached = _etags.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    etag = f'"{digest.hexdigest()[:32]}"'
+
+    with _etags_lock:
+        _etags[path] = (key, etag)
+    return etag
+
+
+def cache_control_for(date):
+    try:
+        week_start = datetime.datetime.strptime(date, "%Y-%m-%d").date()
+    except ValueError:
+        return "no-cache"
+
+    if week_start + datetime.timedelta(days=7) <= datetime.date.today():
+        return f"public, max-age={PAST_WEEK_MAX_AGE}"
+    return f"public, max-age={CURRENT_WEEK_MAX_AGE}"
+
+
+def parse_range(range_header, file_size):
+    # Only single byte ranges are honored; anything else is answered with the
+    # whole file, which RFC 9110 allows
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+
+    start, _, end = spec.strip().partition("-")
+    try:
+        if start:
+            start = int(start)
+            end = min(int(end), file_size - 1) if end else file_size - 1
+        else:
+            start = max(file_size - int(end), 0)
+            end = file_size - 1
+    except ValueError:
+        return None
+
+    if start > end or start >= file_size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable.",
+            headers={"Content-Range": f"bytes */{file_size}"},
+        )
+    return start, end
+
+
+def etag_matches(header, etag):
+    if header is None:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def iter_range(path, start, end, chunk_size=RANGE_CHUNK_SIZE):
+    # Bytes start to end inclusive, in chunks so that open ranges such as
+    # bytes=0- are not read into memory at once
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def resolve_path(base_dir, rel_path):
+    base_dir = os.path.realpath(base_dir)
+    abs_path = os.path.realpath(os.path.join(base_dir, rel_path))
+    if os.path.commonpath([base_dir, abs_path]) != base_dir:
+        raise HTTPException(status_code=404, detail="File not found.")
+    return abs_path
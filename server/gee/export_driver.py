@@ -0,0 +1,207 @@
+import os
+import json
+import time
+
+# Shared driver for Earth Engine batch exports. Scripts register one job per
+# export with a factory that builds the (unstarted) ee.batch task; the driver
+# starts at most max_concurrent tasks at a time, polls them with exponential
+# backoff, rebuilds and restarts failed tasks up to max_retries times, and
+# writes a manifest of the outcome that download.py can consume.
+#
+# A driver created with the completed exports of the script's previous
+# manifest (resume_exports) records those jobs as done without submitting
+# them again, so rerunning a script only exports what is still missing.
+# Exports are told apart by description and file format, since an image and
+# its stats table can share a description.
+#
+# The driver only relies on the task interface (start(), status(), id), so it
+# runs unchanged against the local stand-in in fake_ee.py.
+
+export_concurrency = int(os.getenv("EXPORT_CONCURRENCY", 10))
+export_manifest_path = os.getenv("EXPORT_MANIFEST", "export_manifest.json")
+export_force = os.getenv("EXPORT_FORCE", "0") == "1"
+
+ACTIVE_STATES = {"UNSUBMITTED", "READY", "RUNNING", "CANCEL_REQUESTED"}
+FAILED_STATES = {"FAILED", "CANCELLED"}
+COMPLETED_STATE = "COMPLETED"
+
+
+def export_key(description, file_format=None):
+    return description, file_format
+
+
+class ExportJob:
+    def __init__(self, description, create_task, file_format, metadata=None):
+        self.description = description
+        self.create_task = create_task
+        self.file_format = file_format
+        self.metadata = metadata or {}
+        self.task = None
+        self.state = "PENDING"
+        self.attempts = 0
+        self.error = None
+        self.destination_uris = []
+        self.started_at = None
+        self.finished_at = None
+        self.previous = None
+
+    def to_dict(self):
+        if self.previous is not None:
+            return {**self.previous, "skipped": True}
+        return {
+            "description": self.description,
+            "file_format": self.file_format,
+            "state": self.state,
+            "task_id": getattr(self.task, "id", None),
+            "attempts": self.attempts,
+            "error": self.error,
+            "destination_uris": self.destination_uris,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            **self.metadata,
+        }
+
+
+class ExportDriver:
+    def __init__(
+        self,
+        max_concurrent=export_concurrency,
+        max_retries=2,
+        poll_interval=5,
+        max_poll_interval=60,
+        sleep=time.sleep,
+        completed=None,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.sleep = sleep
+        self.completed = completed or {}
+        self.jobs = []
+
+    def add(self, description, create_task, *, file_format, **metadata):
+        # file_format is the fileFormat the task exports, or None for assets
+        job = ExportJob(description, create_task, file_format, metadata)
+        previous = self.completed.get(export_key(description, file_format))
+        if previous is not None:
+            job.state = COMPLETED_STATE
+            job.previous = previous
+            print(f"Skipping export {description}, completed in a previous run")
+        self.jobs.append(job)
+        return job
+
+    def _start(self, job):
+        job.attempts += 1
+        job.error = None
+        job.task = job.create_task()
+        job.task.start()
+        job.state = "READY"
+        job.started_at = time.time()
+        print(f"Started export {job.description} (attempt {job.attempts})")
+
+    def _poll(self, job):
+        # Returns True when the job's state changed
+        status = job.task.status()
+        state = status.get("state", job.state)
+        if state == job.state:
+            return False
+
+        job.state = state
+        if state == COMPLETED_STATE:
+            job.destination_uris = status.get("destination_uris", [])
+            job.finished_at = time.time()
+            print(f"Export {job.description} completed")
+        elif state in FAILED_STATES:
+            job.error = status.get("error_message")
+            job.finished_at = time.time()
+            print(f"Export {job.description} {state.lower()}: {job.error}")
+        return True
+
+    def run(self):
+        pending = [job for job in self.jobs if job.state == "PENDING"]
+        pending.reverse()
+        running = []
+        interval = self.poll_interval
+
+        while pending or running:
+            while pending and len(running) < self.max_concurrent:
+                job = pending.pop()
+                try:
+                    self._start(job)
+                    running.append(job)
+                except Exception as e:
+                    job.state = "FAILED"
+                    job.error = str(e)
+                    print(f"Could not start export {job.description}: {e}")
+
+            if not running:
+                continue
+
+            self.sleep(interval)
+            changed = False
+            for job in list(running):
+                try:
+                    changed = self._poll(job) or changed
+                except Exception as e:
+                    # Status calls can fail transiently; try again next round
+                    print(f"Could not poll export {job.description}: {e}")
+                    continue
+
+                if job.state in ACTIVE_STATES:
+                    continue
+                running.remove(job)
+                if job.state in FAILED_STATES and job.attempts <= self.max_retries:
+                    job.state = "PENDING"
+                    pending.append(job)
+
+            # Poll quickly while tasks are moving, back off while they idle
+            if changed:
+                interval = self.poll_interval
+            else:
+                interval = min(interval * 2, self.max_poll_interval)
+
+        return self.jobs
+
+    def summary(self):
+        counts = {}
+        for job in self.jobs:
+            counts[job.state] = counts.get(job.state, 0) + 1
+        return counts
+
+    def write_manifest(self, path=export_manifest_path):
+        manifest = {
+            "generated_at": time.time(),
+            "summary": self.summary(),
+            "exports": [job.to_dict() for job in self.jobs],
+        }
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f"{path}.tmp", path)
+        print(f"Wrote export manifest to {path}")
+
+
+def resume_exports(path):
+    # Completed exports of a previous run, keyed by export_key; empty when
+    # there is no manifest yet or EXPORT_FORCE=1
+    if export_force or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+    return {
+        export_key(export["description"], export.get("file_format")): export
+        for export in manifest["exports"]
+        if export["state"] == COMPLETED_STATE
+    }
+
+
+def load_completed_exports(path):
+    # Descriptions of the completed exports in a manifest; Drive exports are
+    # named after their description
+    with open(path) as f:
+        manifest = json.load(f)
+    return {
+        export["description"]
+        for export in manifest["exports"]
+        if export["state"] == COMPLETED_STATE
+    }
@@ -0,0 +1,125 @@
+import datetime
+import itertools
+from types import SimpleNamespace
+
+# Local stand-in for the parts of the Earth Engine API used by the export
+# pipeline, for running it without network access or credentials, e.g.
+#
+#     import fake_ee
+#     from export_driver import ExportDriver
+#
+#     batch = fake_ee.FakeBatch(failures={"riyadh_ndvi_2025-01-05": 1})
+#     driver = ExportDriver(sleep=lambda seconds: None)
+#     driver.add("riyadh_ndvi_2025-01-05",
+#                lambda: batch.Export.image.toDrive(description="riyadh_ndvi_2025-01-05"),
+#                file_format="GeoTIFF")
+#     driver.run()
+#
+# Passing the module itself as `ee` to planner.build_plan() runs the export
+# planning against FakeImageCollection objects instead of Earth Engine.
+
+_task_ids = itertools.count(1)
+
+
+class FakeTask:
+    # Moves READY -> RUNNING -> COMPLETED (or FAILED) one step per status()
+    # call, like a real task observed at a slow polling rate
+
+    def __init__(self, config, fail=False):
+        self.config = config
+        self.id = f"FAKE{next(_task_ids):06d}"
+        self.fail = fail
+        self.started = False
+        self._states = iter(["READY", "RUNNING", "FAILED" if fail else "COMPLETED"])
+        self._state = "UNSUBMITTED"
+
+    def start(self):
+        self.started = True
+
+    def status(self):
+        if self.started and self._state not in ("COMPLETED", "FAILED"):
+            self._state = next(self._states)
+
+        status = {"id": self.id, "state": self._state, **self.config}
+        if self._state == "FAILED":
+            status["error_message"] = "Fake failure"
+        if self._state == "COMPLETED":
+            status["destination_uris"] = [
+                f"https://drive.google.com/#folders/{self.config.get('folder', '')}"
+            ]
+        return status
+
+
+class FakeBatch:
+    # failures maps a task description to how many attempts should fail
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})
+        self.tasks = []
+        self.Export = SimpleNamespace(
+            image=SimpleNamespace(toDrive=self._create, toAsset=self._create),
+            table=SimpleNamespace(toDrive=self._create, toAsset=self._create),
+        )
+
+    def _create(self, **config):
+        description = config.get("description")
+        fail = self.failures.get(description, 0) > 0
+        if fail:
+            self.failures[description] -= 1
+        task = FakeTask(config, fail)
+        self.tasks.append(task)
+        return task
+
+
+# Minimal lazy values for planning code: every object evaluates locally and
+# getinfo_calls counts the round trips a real client would have made.
+getinfo_calls = 0
+
+
+def _evaluate(value):
+    if isinstance(value, FakeComputedObject):
+        return value.evaluate()
+    if isinstance(value, dict):
+        return {key: _evaluate(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_evaluate(item) for item in value]
+    return value
+
+
+class FakeComputedObject:
+    def __init__(self, evaluate):
+        self.evaluate = evaluate
+
+    def getInfo(self):
+        global getinfo_calls
+        getinfo_calls += 1
+        return self.evaluate()
+
+
+def Date(value):
+    date = datetime.date.fromisoformat(str(value)[:10])
+    return FakeComputedObject(lambda: date)
+
+
+def List(values):
+    return FakeComputedObject(lambda: _evaluate(values))
+
+
+def Dictionary(values):
+    return FakeComputedObject(lambda: _evaluate(values))
+
+
+class FakeImageCollection:
+    # Collection of image acquisition dates
+
+    def __init__(self, dates):
+        self.dates = [datetime.date.fromisoformat(date) for date in dates]
+
+    def filterDate(self, start, end):
+        start, end = _evaluate(start), _evaluate(end)
+        return FakeImageCollection(
+            [date.isoformat() for date in self.dates if start <= date < end]
+        )
+
+    def size(self):
+        return FakeComputedObject(lambda: len(self.dates))
@@ -0,0 +1,72 @@
+import os
+import json
+import datetime
+
+# Cities, boundary assets, date window and analyses of the processing jobs,
+# read from jobs.json by the GEE scripts and by server/orchestrate.py. A city
+# may list its own "analyses" to override the default list. The period ends
+# at "end" (YYYY-MM-DD, today when null) and spans "months" months back.
+# The boundary assets are read from "boundaries"; BASE_DEST is only used when
+# jobs.json leaves it out, so the two cannot silently disagree.
+#
+# JOB_CITIES (comma separated city folder names) narrows a script run to
+# some of the configured cities; the orchestrator sets it for the cities that
+# still have missing weeks.
+
+jobs_config_path = os.getenv(
+    "JOBS_CONFIG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "jobs.json"),
+)
+
+
+def clean_city_name(name):
+    # Folder and asset name of a city, as the scripts have always built it
+    return name.replace(" ", "").lower()
+
+
+def load_job_config(path=jobs_config_path):
+    with open(path) as f:
+        config = json.load(f)
+
+    period = config.get("period", {})
+    analyses = config.get("analyses", [])
+    return {
+        "boundaries": config.get("boundaries") or os.environ["BASE_DEST"],
+        "months": period.get("months", -6),
+        "end": period.get("end"),
+        "analyses": analyses,
+        "cities": [
+            {
+                "name": city["name"],
+                "clean_name": clean_city_name(city["name"]),
+                "analyses": city.get("analyses", analyses),
+            }
+            for city in config["cities"]
+        ],
+    }
+
+
+def period_end(config):
+    if config["end"]:
+        return datetime.datetime.strptime(config["end"], "%Y-%m-%d")
+    return datetime.datetime.now()
+
+
+def select_cities(config, analysis=None, names=None):
+    # analysis is one analysis or a list of them, any of which a city has to
+    # list
+    names = names if names is not None else os.getenv("JOB_CITIES")
+    wanted = {name.strip() for name in names.split(",")} if names else None
+    analyses = [analysis] if isinstance(analysis, str) else analysis
+    cities = [
+        city
+        for city in config["cities"]
+        if (analyses is None or any(a in city["analyses"] for a in analyses))
+        and (wanted is None or city["clean_name"] in wanted)
+    ]
+    if not cities:
+        print(
+            f"Warning: no configured city lists {' or '.join(analyses or ['any analysis'])}"
+            + (f" among {', '.join(sorted(wanted))}" if wanted else "")
+        )
+    return cities
@@ -1,8 +1,13 @@
 import ee
 import os
-from datetime import datetime
+from functools import partial
 from dotenv import load_dotenv
 
+from export_driver import ExportDriver, resume_exports
+from job_config import load_job_config, period_end, select_cities
+from planner import build_plan, plan_week_dates, record_empty_weeks
+from urban_mask_cache import get_urban_mask, month_period
+
 load_dotenv(dotenv_path='../.env')
 
 ee.Authenticate()
@@ -10,24 +15,35 @@ ee.Authenticate()
 project_name = os.getenv('PROJECT_NAME', 'ee-shashigharti')
 ee.Initialize(project=project_name)
 
-city_names = ['Riyadh']  # Modify this for multiple cities
+# With UHI_LOCAL=1 only the LST image is exported and server/uhi.py derives
+# the UHI image and stats from it and the urban mask, for the cities that
+# list either uhi or lst
+uhi_local = os.getenv('UHI_LOCAL', '0') == '1'
+analysis = 'lst' if uhi_local else 'uhi'
+
+config = load_job_config()
+city_names = [
+    city['name'] for city in select_cities(config, ['uhi', 'lst'] if uhi_local else 'uhi')
+]
 
 # Process the aoi for the cities
 # Change this to your own path
-dest = os.getenv('BASE_DEST', 'users/shashigharti/data/processed/saudi/city_boundaries/')
+dest = config['boundaries']
+# Folder the cached urban masks are stored in
+urban_mask_assets = os.getenv('URBAN_MASK_ASSETS', dest)
+urban_threshold = 5
 
-months = -6
-end_date = ee.Date(datetime.now().strftime('%Y-%m-%d'))
+manifest_path = f'export_manifest_{analysis}.json'
+driver = ExportDriver(completed=resume_exports(manifest_path))
+
+months = config['months']
+end_date = ee.Date(period_end(config).strftime('%Y-%m-%d'))
 start_date = end_date.advance(months, 'month')
-total_days = end_date.difference(start_date, 'day')
-num_weeks = total_days.divide(7).floor().getInfo()
+week_dates = plan_week_dates(period_end(config), months)
+viirs_period = month_period(period_end(config), months)
 
 # Generate list of weeks for past months specified by user
-weeks = []
-for i in range(num_weeks):
-    start_week = start_date.advance(i * 7, 'day')
-    end_week = start_week.advance(6, 'day')
-    weeks.append({'start': start_week, 'end': end_week})
+weeks = [{'start': start, 'end': end} for start, end in week_dates]
 
 lst_vis_params = {
     'min': 0,
@@ -40,11 +56,6 @@ uhi_vis_params = {
     'palette': ['blue', 'white', 'red']
 }
 
-weekly_intervals = [
-    {'start': start_date.advance(i * 7, 'day'), 'end': start_date.advance(i * 7 + 6, 'day')}
-    for i in range(num_weeks)
-]
-
 def mask_invalid_pixels(image):
     qa_mask = image.select('QA_PIXEL')
     cloud_mask = qa_mask.bitwise_and(1 << 5).eq(0)
@@ -59,31 +70,21 @@ def calculate_lst(image):
         .rename('lst')
     return image.addBands(lst_celsius)
 
-def get_urban_mask(city_name):
-    clean_name = city_name.replace(" ", "").lower()
-    city_boundary = ee.FeatureCollection(f'{dest}{clean_name}')
-    viirs = ee.ImageCollection("NOAA/VIIRS/DNB/MONTHLY_V1/VCMSLCFG") \
-        .filterDate(start_date, end_date) \
-        .filterBounds(city_boundary)
-    mean_lights = viirs.select('avg_rad').mean()
-    return mean_lights.gt(5).clip(city_boundary)
-
 landsat_images = ee.ImageCollection('LANDSAT/LC08/C02/T1_L2') \
     .filterDate(start_date, end_date) \
     .filterMetadata('CLOUD_COVER', 'less_than', 1) \
     .map(mask_invalid_pixels)
 
-def export_lst_and_uhi(city_name, week_start, week_end):
+def export_lst_and_uhi(city_name, week, urban_mask):
+    if week['count'] <= 0:
+        return
+
     clean_name = city_name.replace(" ", "").lower()
     city_boundary = ee.FeatureCollection(f'{dest}{clean_name}')
-    urban_mask = get_urban_mask(city_name)
 
-    week_filter = ee.Filter.date(week_start, week_end)
+    week_filter = ee.Filter.date(ee.Date(week['start']), ee.Date(week['end']))
     weekly_images = landsat_images.filter(week_filter).map(calculate_lst)
 
-    if weekly_images.size().getInfo() <= 0:
-        return
-
     lst_mean = weekly_images.select('lst').mean().clip(city_boundary)
     mask = lst_mean.mask()
     lst_mean = lst_mean.updateMask(mask)
@@ -123,23 +124,25 @@ def export_lst_and_uhi(city_name, week_start, week_end):
         ).get('lst')
     }
 
-    # print(f"Mean values for {city_name}, week of {week_start.format('YYYY-MM-dd').getInfo()}:", stats)
+    # print(f"Mean values for {city_name}, week of {week['start']}:", stats)
 
-    processed_date = week_start.format('YYYY-MM-dd').getInfo()
+    processed_date = week['start']
     file_name = f"{clean_name}_lst_{processed_date}"
 
-    # ee.batch.Export.image.toDrive(**{
-    #     'image': lst_mean,
-    #     'description': file_name,
-    #     'scale': 30,
-    #     'region': city_boundary.geometry(),
-    #     'fileFormat': 'GeoTIFF',
-    #     'folder': 'processed',
-    #     'maxPixels': 1e8
-    # }).start()
+    if uhi_local:
+        driver.add(file_name, partial(ee.batch.Export.image.toDrive, **{
+            'image': lst_mean,
+            'description': file_name,
+            'scale': 30,
+            'region': city_boundary.geometry(),
+            'fileFormat': 'GeoTIFF',
+            'folder': 'processed',
+            'maxPixels': 1e8
+        }), file_format='GeoTIFF', city=clean_name, analysis='lst', date=processed_date)
+        return
 
     file_name = f"{clean_name}_uhi_{processed_date}"
-    ee.batch.Export.image.toDrive(**{
+    driver.add(file_name, partial(ee.batch.Export.image.toDrive, **{
         'image': uhi,
         'description': file_name,
         'scale': 30,
@@ -147,7 +150,7 @@ def export_lst_and_uhi(city_name, week_start, week_end):
         'fileFormat': 'GeoTIFF',
         'folder': 'processed',
         'maxPixels': 1e8
-    }).start()
+    }), file_format='GeoTIFF', city=clean_name, analysis='uhi', date=processed_date)
 
     # file_name = f"{clean_name}_lst_{processed_date}"
     # ee.batch.Export.table.toDrive(**{
@@ -157,14 +160,34 @@ def export_lst_and_uhi(city_name, week_start, week_end):
     #     'folder': 'processed',
     # }).start()
 
+    # Same description as the image export; Drive tells them apart by
+    # extension and the export driver by file_format
     file_name = f"{clean_name}_uhi_{processed_date}"
-    ee.batch.Export.table.toDrive(**{
+    driver.add(file_name, partial(ee.batch.Export.table.toDrive, **{
         'collection': ee.FeatureCollection([ee.Feature(city_boundary.geometry(), stats.get('uhi_index'))]),
         'description': file_name,
         'fileFormat': 'GeoJSON',
         'folder': 'processed',
-    }).start()
+    }), file_format='GeoJSON', city=clean_name, analysis='uhi', date=processed_date)
+
+# Image counts for every city and week, fetched in a single request
+collections = {
+    city: landsat_images.filterBounds(ee.FeatureCollection(f'{dest}{city.replace(" ", "").lower()}'))
+    for city in city_names
+}
+plan = build_plan(ee, week_dates, collections)
 
 for city in city_names:
-    for interval in weekly_intervals:
-        export_lst_and_uhi(city, interval['start'], interval['end'])
+    clean_name = city.replace(" ", "").lower()
+    # Same mask for every week of the period, built once and cached
+    urban_mask = get_urban_mask(
+        ee, driver, ee.FeatureCollection(f'{dest}{clean_name}'), clean_name,
+        viirs_period, urban_threshold, urban_mask_assets
+    )
+    for week in plan[city]:
+        export_lst_and_uhi(city, week, urban_mask)
+    # Without an LST image uhi.py has no UHI to compute either
+    record_empty_weeks(city, plan[city], ['lst', 'uhi'] if uhi_local else ['uhi'])
+
+driver.run()
+driver.write_manifest(manifest_path)
@@ -1,8 +1,12 @@
 import ee
 import os
-from datetime import datetime
+from functools import partial
 from dotenv import load_dotenv
 
+from export_driver import ExportDriver, resume_exports
+from job_config import load_job_config, period_end, select_cities
+from planner import build_plan, plan_week_dates, record_empty_weeks
+
 load_dotenv(dotenv_path='../.env')
 
 ee.Authenticate()
@@ -10,27 +14,21 @@ ee.Authenticate()
 project_name = os.getenv('PROJECT_NAME', 'ee-shashigharti')
 ee.Initialize(project=project_name)
 
-city_names = ['Riyadh']
+config = load_job_config()
+city_names = [city['name'] for city in select_cities(config, 'ndvi')]
 
 # Process the aoi for the cities
 # Change this to your own path
-dest = os.getenv('BASE_DEST', 'users/shashigharti/data/processed/saudi/city_boundaries/')
+dest = config['boundaries']
+
+manifest_path = 'export_manifest_ndvi.json'
+driver = ExportDriver(completed=resume_exports(manifest_path))
 
 threshold = 10
 
 # Set date range
-months = -6
-end_date = ee.Date(datetime.now().strftime('%Y-%m-%d'))
-start_date = end_date.advance(months, 'month')
-total_days = end_date.difference(start_date, 'day')
-num_weeks = total_days.divide(7).floor().getInfo()
-
-# Generate list of weeks for past months specified by user
-weeks = []
-for i in range(num_weeks):
-    start_week = start_date.advance(i * 7, 'day')
-    end_week = start_week.advance(6, 'day')
-    weeks.append({'start': start_week, 'end': end_week})
+months = config['months']
+week_dates = plan_week_dates(period_end(config), months)
 
 # Cloud mask function
 def mask_s2_clouds(image):
@@ -55,48 +53,59 @@ ndvi_params = {
     # green -> high NDVI (e.g., dense vegetation, forests, agricultural areas)
 }
 
-# Export NDVI to Drive
-def export_ndvi(city_name):
+def s2_collection(city_aoi):
+    return (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+            .filterBounds(city_aoi)
+            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20)))
+
+# Export NDVI to Drive, one export per week of the plan that has images
+def export_ndvi(city_name, city_plan):
     clean_name = city_name.replace(" ", "").lower()
     city_aoi = ee.FeatureCollection(f'{dest}{clean_name}')
     
-    for week in weeks:
+    for week in city_plan:
+        if week['count'] == 0:
+            print(f"No valid images for {clean_name} during week starting {week['start']}")
+            continue
+
         week_start = ee.Date(week['start'])
         week_end = ee.Date(week['end'])
 
-        dataset = (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
-                   .filterBounds(city_aoi)
+        dataset = (s2_collection(city_aoi)
                    .filterDate(week_start, week_end)
-                   .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20))
                    .map(mask_s2_clouds))
-        
-        dataset_size = dataset.size().getInfo()
-        if dataset_size == 0:
-            print(f"No valid images for {clean_name} during week starting {week_start.format('YYYY-MM-dd').getInfo()}")
-            continue
 
         ndvi = dataset.map(calculate_ndvi).mean().select('NDVI').clip(city_aoi)
-        processed_date = week_start.format('YYYY-MM-dd').getInfo()
+        processed_date = week['start']
         file_name = f"{clean_name}_ndvi_{processed_date}"
 
-        task = ee.batch.Export.image.toDrive(
-            image=ndvi,
-            description=file_name,
-            scale=30,
-            region=city_aoi.geometry(),
-            fileFormat='GeoTIFF',
-            folder='processed',
-            maxPixels=1e8
+        driver.add(
+            file_name,
+            partial(
+                ee.batch.Export.image.toDrive,
+                image=ndvi,
+                description=file_name,
+                scale=30,
+                region=city_aoi.geometry(),
+                fileFormat='GeoTIFF',
+                folder='processed',
+                maxPixels=1e8
+            ),
+            file_format='GeoTIFF',
+            city=clean_name,
+            analysis='ndvi',
+            date=processed_date,
         )
-        task.start()
-        print(f'Exporting {file_name} to Google Drive...')
+        print(f'Queued {file_name} for export to Google Drive...')
 
 # Add weekly NDVI layers to map (optional for geemap/folium)
-def add_to_map(city_name):
+def add_to_map(city_name, city_plan):
+    # city_plan is the city's entry of build_plan, so empty weeks are known
+    # without a round trip per week
     clean_name = city_name.replace(" ", "").lower()
     city_aoi = ee.FeatureCollection(f'{dest}{clean_name}')
     
-    for week in weeks:
+    for week in city_plan:
         week_start = ee.Date(week['start'])
         week_end = ee.Date(week['end'])
         
@@ -106,15 +115,26 @@ def add_to_map(city_name):
                    .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20))
                    .map(mask_s2_clouds))
         
-        if dataset.size().getInfo() > 0:
+        if week['count'] > 0:
             ndvi = dataset.map(calculate_ndvi).mean().select('NDVI').clip(city_aoi)
-            week_label = week_start.format('YYYY-MM-dd').getInfo()
+            week_label = week['start']
             # Uncomment below if using geemap or folium
             # Map.addLayer(ndvi, ndvi_params, f'{clean_name} NDVI {week_label}')
         else:
-            print(f'No valid images for {clean_name} during week starting {week_start.format("YYYY-MM-dd").getInfo()}')
+            print(f'No valid images for {clean_name} during week starting {week["start"]}')
+
+# Image counts for every city and week, fetched in a single request
+collections = {
+    city: s2_collection(ee.FeatureCollection(f'{dest}{city.replace(" ", "").lower()}'))
+    for city in city_names
+}
+plan = build_plan(ee, week_dates, collections)
 
 # Run for each city
 for city in city_names:
     print(f'Processing {city}...')
-    export_ndvi(city)
\ No newline at end of file
+    export_ndvi(city, plan[city])
+    record_empty_weeks(city, plan[city], ['ndvi'])
+
+driver.run()
+driver.write_manifest(manifest_path)
@@ -0,0 +1,91 @@
+import os
+import json
+import datetime
+import calendar
+
+# Export planning for the GEE scripts. Week boundaries are plain calendar
+# arithmetic and are computed locally; the only thing that needs Earth Engine
+# is how many images fall in each week, and those counts are fetched for all
+# cities and all weeks in a single getInfo() call. The scripts then drive
+# their exports from the returned plan without further round trips.
+#
+# The weeks a plan finds no images for are recorded under EMPTY_WEEKS_DIR,
+# one file per city and analysis, so that server/orchestrate.py does not
+# count them as missing and run the export again on every run.
+
+empty_weeks_folder = os.getenv(
+    'EMPTY_WEEKS_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'empty_weeks'),
+)
+
+
+def shift_months(date, months):
+    # Same as ee.Date.advance(months, 'month'), clamping to the month's end
+    month_index = date.month - 1 + months
+    year = date.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return date.replace(year=year, month=month, day=day)
+
+
+def plan_week_dates(end_date, months):
+    # (start, end) labels of every whole week in the period ending at
+    # end_date; a week spans start to start + 6 days like the original loops
+    if isinstance(end_date, datetime.datetime):
+        end_date = end_date.date()
+    start_date = shift_months(end_date, months)
+    num_weeks = (end_date - start_date).days // 7
+
+    weeks = []
+    for i in range(num_weeks):
+        week_start = start_date + datetime.timedelta(days=i * 7)
+        week_end = week_start + datetime.timedelta(days=6)
+        weeks.append((week_start.strftime('%Y-%m-%d'), week_end.strftime('%Y-%m-%d')))
+    return weeks
+
+
+def build_plan(ee, week_dates, collections):
+    # collections maps a city to the ee.ImageCollection its exports are
+    # built from. Returns {city: [{'start', 'end', 'count'}, ...]}.
+    counts = ee.Dictionary({
+        city: ee.List([
+            collection.filterDate(ee.Date(start), ee.Date(end)).size()
+            for start, end in week_dates
+        ])
+        for city, collection in collections.items()
+    }).getInfo()
+
+    return {
+        city: [
+            {'start': start, 'end': end, 'count': count}
+            for (start, end), count in zip(week_dates, counts[city])
+        ]
+        for city in collections
+    }
+
+
+def empty_weeks_path(clean_name, analysis, folder=empty_weeks_folder):
+    return os.path.join(folder, f'{clean_name}_{analysis}.json')
+
+
+def record_empty_weeks(city_name, city_plan, analyses, folder=empty_weeks_folder):
+    # Writes the start of every week of city_plan without images for each
+    # analysis, replacing what an earlier run recorded
+    clean_name = city_name.replace(' ', '').lower()
+    empty = [week['start'] for week in city_plan if week['count'] <= 0]
+    os.makedirs(folder, exist_ok=True)
+    for analysis in analyses:
+        path = empty_weeks_path(clean_name, analysis, folder)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(empty, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def load_empty_weeks(clean_name, analysis, folder=empty_weeks_folder):
+    # Week starts recorded as empty, none when the export never ran
+    try:
+        with open(empty_weeks_path(clean_name, analysis, folder)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
@@ -0,0 +1,157 @@
+import ee
+import os
+from functools import partial
+from dotenv import load_dotenv
+
+from export_driver import ExportDriver, resume_exports
+from job_config import load_job_config, period_end, select_cities
+from planner import build_plan, plan_week_dates, record_empty_weeks
+
+# Builds the masked weekly Sentinel-2 composite once per city and week and
+# derives every index in S2_INDICES from it, instead of ndvi.py, ndbi.py and
+# albedo.py each building the same collection. Exports are either one
+# multi-band GeoTIFF per week (<city>_s2_<date>, split into the per-index
+# folders by download.py) or one GeoTIFF per index named like the single
+# index scripts, e.g.
+#
+#     S2_EXPORT_MODE=multiband python s2_indices.py
+
+load_dotenv(dotenv_path='../.env')
+
+ee.Authenticate()
+
+project_name = os.getenv('PROJECT_NAME', 'ee-shashigharti')
+ee.Initialize(project=project_name)
+
+config = load_job_config()
+
+# Process the aoi for the cities
+# Change this to your own path
+dest = config['boundaries']
+
+# 'multiband' or 'per-index'
+export_mode = os.getenv('S2_EXPORT_MODE', 'per-index')
+
+manifest_path = 'export_manifest_s2.json'
+driver = ExportDriver(completed=resume_exports(manifest_path))
+
+# Set date range
+months = config['months']
+week_dates = plan_week_dates(period_end(config), months)
+
+# Cloud mask function
+def mask_s2_clouds(image):
+    qa = image.select('QA60')
+    cloud_bit_mask = 1 << 10
+    cirrus_bit_mask = 1 << 11
+    mask = qa.bitwiseAnd(cloud_bit_mask).eq(0).And(qa.bitwiseAnd(cirrus_bit_mask).eq(0))
+    return image.updateMask(mask).divide(10000)
+
+def calculate_ndvi(image):
+    return image.normalizedDifference(['B8', 'B4'])
+
+def calculate_ndbi(image):
+    return image.normalizedDifference(['B11', 'B8'])
+
+# Same weighted band coefficients as albedo.py (Liu et al., 2020)
+def calculate_albedo(image):
+    return (image.select('B2').multiply(0.279)
+            .add(image.select('B3').multiply(0.192))
+            .add(image.select('B4').multiply(0.119))
+            .add(image.select('B8').multiply(0.093))
+            .add(image.select('B11').multiply(0.043))
+            .add(image.select('B12').multiply(0.017)))
+
+# Analysis name -> index function, in band order of the multi-band export.
+# Keep in sync with multiband_analyses in download.py.
+S2_INDICES = {
+    'ndvi': calculate_ndvi,
+    'ndbi': calculate_ndbi,
+    'albedo': calculate_albedo,
+}
+
+# Indices to export for every city that lists at least one of them
+city_analyses = {
+    city['name']: [analysis for analysis in S2_INDICES if analysis in city['analyses']]
+    for city in select_cities(config)
+}
+city_names = [name for name, analyses in city_analyses.items() if analyses]
+
+def add_indices(image):
+    # Indices are computed per image and averaged afterwards, like the single
+    # index scripts, so the values match theirs
+    return ee.Image.cat([
+        calculate(image).rename(analysis)
+        for analysis, calculate in S2_INDICES.items()
+    ])
+
+def s2_collection(city_aoi):
+    return (ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED')
+            .filterBounds(city_aoi)
+            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20)))
+
+def weekly_composite(city_aoi, week):
+    return (s2_collection(city_aoi)
+            .filterDate(ee.Date(week['start']), ee.Date(week['end']))
+            .map(mask_s2_clouds)
+            .map(add_indices)
+            .mean()
+            .clip(city_aoi))
+
+def queue_export(file_name, image, city_aoi, clean_name, analysis, processed_date):
+    driver.add(
+        file_name,
+        partial(
+            ee.batch.Export.image.toDrive,
+            image=image,
+            description=file_name,
+            scale=30,
+            region=city_aoi.geometry(),
+            fileFormat='GeoTIFF',
+            folder='processed',
+            maxPixels=1e8
+        ),
+        file_format='GeoTIFF',
+        city=clean_name,
+        analysis=analysis,
+        date=processed_date,
+    )
+    print(f'Queued {file_name} for export to Google Drive...')
+
+def export_indices(city_name, city_plan, analyses):
+    clean_name = city_name.replace(" ", "").lower()
+    city_aoi = ee.FeatureCollection(f'{dest}{clean_name}')
+
+    for week in city_plan:
+        if week['count'] == 0:
+            print(f"No valid images for {clean_name} during week starting {week['start']}")
+            continue
+
+        composite = weekly_composite(city_aoi, week)
+        processed_date = week['start']
+
+        # download.py splits the multi-band export into all of S2_INDICES, so
+        # cities with only some of them get one export per index
+        if export_mode == 'multiband' and len(analyses) == len(S2_INDICES):
+            file_name = f"{clean_name}_s2_{processed_date}"
+            queue_export(file_name, composite.toFloat(), city_aoi, clean_name, 's2', processed_date)
+            continue
+
+        for analysis in analyses:
+            file_name = f"{clean_name}_{analysis}_{processed_date}"
+            queue_export(file_name, composite.select(analysis), city_aoi, clean_name, analysis, processed_date)
+
+# Image counts for every city and week, fetched in a single request
+collections = {
+    city: s2_collection(ee.FeatureCollection(f'{dest}{city.replace(" ", "").lower()}'))
+    for city in city_names
+}
+plan = build_plan(ee, week_dates, collections)
+
+for city in city_names:
+    print(f'Processing {city}...')
+    export_indices(city, plan[city], city_analyses[city])
+    record_empty_weeks(city, plan[city], city_analyses[city])
+
+driver.run()
+driver.write_manifest(manifest_path)
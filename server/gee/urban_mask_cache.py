@@ -0,0 +1,86 @@
+import datetime
+from functools import partial
+
+from planner import shift_months
+
+# Urban masks from VIIRS night lights, built once per city, period and
+# threshold and kept as an Earth Engine asset that lst.py and urbanmask.py
+# reuse on later runs instead of recomputing the radiance mean. The first run
+# for a key uses the computed mask directly and queues its export to the
+# asset on the script's ExportDriver.
+
+VIIRS_COLLECTION = "NOAA/VIIRS/DNB/MONTHLY_V1/VCMSLCFG"
+
+
+def month_period(end_date, months):
+    # VIIRS composites are monthly and stamped with the first day of their
+    # month, so filterDate(start, end) selects the months whose first day
+    # falls in [start, end). Snapping both ends to a month start selects the
+    # same images and gives a key that stays the same for a whole month.
+    if isinstance(end_date, datetime.datetime):
+        end_date = end_date.date()
+    start_date = shift_months(end_date, months)
+
+    first = start_date.replace(day=1)
+    if start_date.day > 1:
+        first = shift_months(first, 1)
+    last = end_date.replace(day=1)
+    if end_date.day > 1:
+        last = shift_months(last, 1)
+    return first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d')
+
+
+def urban_mask_asset_id(asset_folder, clean_name, period, threshold):
+    start, end = period
+    threshold_label = str(threshold).replace('.', 'p')
+    return f"{asset_folder}{clean_name}_urbanmask_{start[:7]}_{end[:7]}_t{threshold_label}"
+
+
+def compute_radiance(ee, city_boundary, period):
+    # Mean night light radiance of the period, before any threshold
+    viirs = ee.ImageCollection(VIIRS_COLLECTION) \
+        .filterDate(period[0], period[1]) \
+        .filterBounds(city_boundary)
+    return viirs.select('avg_rad').mean().clip(city_boundary)
+
+
+def compute_urban_mask(ee, city_boundary, period, threshold):
+    return compute_radiance(ee, city_boundary, period).gt(threshold)
+
+
+def asset_exists(ee, asset_id):
+    try:
+        ee.data.getAsset(asset_id)
+        return True
+    except ee.EEException:
+        return False
+
+
+def get_urban_mask(ee, driver, city_boundary, clean_name, period, threshold, asset_folder):
+    asset_id = urban_mask_asset_id(asset_folder, clean_name, period, threshold)
+    if asset_exists(ee, asset_id):
+        print(f"Using cached urban mask {asset_id}")
+        return ee.Image(asset_id)
+
+    mask = compute_urban_mask(ee, city_boundary, period, threshold)
+    description = asset_id.rsplit('/', 1)[-1]
+    driver.add(
+        description,
+        partial(
+            ee.batch.Export.image.toAsset,
+            image=mask,
+            description=description,
+            assetId=asset_id,
+            region=city_boundary.geometry(),
+            scale=30,
+            maxPixels=1e8
+        ),
+        # Assets have no file format
+        file_format=None,
+        city=clean_name,
+        analysis='urbanmask',
+        period=list(period),
+        threshold=threshold,
+    )
+    print(f"Queued urban mask {asset_id} for caching")
+    return mask
@@ -1,8 +1,13 @@
 import ee
 import os
-from datetime import datetime
+from functools import partial
 from dotenv import load_dotenv
 
+from export_driver import ExportDriver, resume_exports
+from job_config import load_job_config, period_end, select_cities
+from planner import plan_week_dates
+from urban_mask_cache import compute_radiance, get_urban_mask, month_period
+
 load_dotenv(dotenv_path='../.env')
 
 ee.Authenticate()
@@ -10,52 +15,71 @@ ee.Authenticate()
 project_name = os.getenv('PROJECT_NAME', 'ee-shashigharti')
 ee.Initialize(project=project_name)
 
-city_names = ['Riyadh']
+config = load_job_config()
+city_names = [city['name'] for city in select_cities(config, 'um')]
 threshold = 10
+# Also export the radiance the mask is thresholded from, for server/uhi.py
+# --threshold to pick another threshold without exporting again
+export_radiance = os.getenv('UM_EXPORT_RADIANCE', '0') == '1'
 
 # Process the aoi for the cities
 # Change this to your own path
-dest = os.getenv('BASE_DEST', 'users/shashigharti/data/processed/saudi/city_boundaries/')
-months = -6
-
-end_date = ee.Date(datetime.now())
-start_date = end_date.advance(months, 'month')
-total_days = end_date.difference(start_date, 'day')
-num_weeks = int(total_days.getInfo() / 7)
+dest = config['boundaries']
+# Folder the cached urban masks are stored in
+urban_mask_assets = os.getenv('URBAN_MASK_ASSETS', dest)
 
-weeks = []
-for i in range(num_weeks):
-    start = start_date.advance(i * 7, 'day')
-    end = start.advance(6, 'day')
-    weeks.append({'start': start, 'end': end})
+manifest_path = 'export_manifest_um.json'
+driver = ExportDriver(completed=resume_exports(manifest_path))
+months = config['months']
 
-viirs = ee.ImageCollection("NOAA/VIIRS/DNB/MONTHLY_V1/VCMSLCFG").filterDate(start_date, end_date)
+# Week labels are computed locally, no round trip needed
+weeks = [{'start': start, 'end': end} for start, end in plan_week_dates(period_end(config), months)]
+viirs_period = month_period(period_end(config), months)
 
-def export_urban_mask(city_name):
-    clean_name = city_name.replace(" ", "").lower()
-    city_boundary = ee.FeatureCollection(f'{dest}{clean_name}')
-    
-    for week in weeks:
-        week_start = week['start']
-        week_end = week['end']
-        date_str = week_start.format('YYYY-MM-dd').getInfo()
-        
-        week_nightlights = viirs.filterDate(week_start, week_end).select('avg_rad').mean()
-        urban_mask = week_nightlights.clip(city_boundary).gt(threshold)
-
-        task = ee.batch.Export.image.toDrive(
-            image=urban_mask,
-            description=f'{clean_name}_um_{date_str}',
+def queue_period_export(clean_name, analysis, image, city_boundary):
+    # One export for all the weeks of the period, named after the first and
+    # last week start; download.py links it into the folder of every week
+    file_name = f"{clean_name}_{analysis}_{weeks[0]['start']}_{weeks[-1]['start']}"
+    driver.add(
+        file_name,
+        partial(
+            ee.batch.Export.image.toDrive,
+            image=image,
+            description=file_name,
             folder='processed',
-            fileNamePrefix=f'{clean_name}_um_{date_str}',
+            fileNamePrefix=file_name,
             scale=30,
             region=city_boundary.geometry(),
             fileFormat='GeoTIFF',
             maxPixels=1e8
-        )
-        
-        task.start()
-        print(f'Export started for {clean_name} - week of {date_str}')
+        ),
+        file_format='GeoTIFF',
+        city=clean_name,
+        analysis=analysis,
+        date=weeks[0]['start'],
+    )
+    print(f'Export queued for {clean_name} {analysis} - weeks {weeks[0]["start"]} to {weeks[-1]["start"]}')
 
-for city in city_names:
+def export_urban_mask(city_name):
+    clean_name = city_name.replace(" ", "").lower()
+    city_boundary = ee.FeatureCollection(f'{dest}{clean_name}')
+
+    # VIIRS composites are monthly, so a week rarely holds one of its own;
+    # every week gets the period's mask, which is computed once and cached
+    urban_mask = get_urban_mask(
+        ee, driver, city_boundary, clean_name, viirs_period, threshold, urban_mask_assets
+    )
+    queue_period_export(clean_name, 'um', urban_mask, city_boundary)
+    if export_radiance:
+        radiance = compute_radiance(ee, city_boundary, viirs_period)
+        queue_period_export(clean_name, 'radiance', radiance.toFloat(), city_boundary)
+
+if not weeks:
+    print('No whole week in the configured period, nothing to export')
+
+for city in city_names if weeks else []:
     export_urban_mask(city)
+
+driver.run()
+driver.write_manifest(manifest_path)
+
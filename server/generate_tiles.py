@@ -1,62 +1,267 @@
 import os
-import datetime
+import sys
+import time
+import json
 import glob
+import hashlib
+import argparse
+import tempfile
 import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dotenv import load_dotenv
+from rasterio.errors import RasterioError
+
+from pyramid import build_pyramid, build_pyramid_archive
 
 load_dotenv()
 
 data_folder = os.getenv("DATAPATH", "data")
 tiles_level = os.getenv("TILES_LEVEL", "6-15")
+tiles_jobs = int(os.getenv("TILES_JOBS", os.cpu_count() or 1))
+tiles_processes = int(os.getenv("TILES_PROCESSES", 1))
+tiles_engine = os.getenv("TILES_ENGINE", "python")
+tiles_output = os.getenv("TILES_OUTPUT", "files")
+fingerprint_file_name = "tiles_fingerprint.json"
+
+
+def get_fingerprint(
+    tif_file_path, use_hash=False, engine=tiles_engine, output=tiles_output
+):
+    # mtime and size are enough to notice a re-downloaded file; the content
+    # hash also catches files rewritten with identical metadata. The zoom
+    # range, engine and output are included so changing TILES_LEVEL,
+    # --engine or --output retiles everything.
+    stat_result = os.stat(tif_file_path)
+    fingerprint = {
+        "size": stat_result.st_size,
+        "mtime_ns": stat_result.st_mtime_ns,
+        "tiles_level": tiles_level,
+        "engine": engine,
+        "output": output,
+    }
+    if use_hash:
+        digest = hashlib.sha256()
+        with open(tif_file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        fingerprint["sha256"] = digest.hexdigest()
+        del fingerprint["mtime_ns"]
+    return fingerprint
+
+
+def read_recorded_fingerprint(tiles_folder_path):
+    try:
+        with open(os.path.join(tiles_folder_path, fingerprint_file_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
 
 
-def get_current_date():
-    return datetime.datetime.now().strftime("%Y-%m-%d")
+def matches_recorded_fingerprint(
+    tiles_folder_path, tif_file_path, engine=tiles_engine, output=tiles_output
+):
+    # Whether the folder was tiled from this image.tif, checked the same way
+    # the recorded fingerprint was made, by content hash for --hash runs
+    recorded = read_recorded_fingerprint(tiles_folder_path)
+    if recorded is None:
+        return False
+    use_hash = "sha256" in recorded
+    return recorded == get_fingerprint(tif_file_path, use_hash, engine, output)
 
 
-def generate_tiles_for_file(tif_file_path, tiles_folder_path):
+def record_fingerprint(tiles_folder_path, fingerprint):
+    path = os.path.join(tiles_folder_path, fingerprint_file_name)
+    fd, tmp_path = tempfile.mkstemp(dir=tiles_folder_path, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(fingerprint, f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def generate_tiles_for_file(tif_file_path, tiles_folder_path, processes=1):
     command = [
         "gdal2tiles.py",
         "-z",
         tiles_level,
         "-r",
         "bilinear",
+        f"--processes={processes}",
         tif_file_path,
         tiles_folder_path,
     ]
 
-    subprocess.run(command)
-    print(f"Tiles generated for {tif_file_path} in {tiles_folder_path}")
+    started = time.monotonic()
+    result = subprocess.run(command, capture_output=True, text=True)
+    elapsed = time.monotonic() - started
+    if result.returncode != 0:
+        print(f"gdal2tiles failed for {tif_file_path}:\n{result.stderr.strip()}")
+    return result.returncode, elapsed
+
+
+def generate_pyramid_for_file(
+    tif_file_path, tiles_folder_path, processes=1, output=tiles_output
+):
+    build = build_pyramid_archive if output == "archive" else build_pyramid
+    started = time.monotonic()
+    try:
+        build(tif_file_path, tiles_folder_path, tiles_level, workers=processes)
+        returncode = 0
+    except (OSError, ValueError, RasterioError) as e:
+        print(f"Pyramid build failed for {tif_file_path}: {e}")
+        returncode = 1
+    return returncode, time.monotonic() - started
+
 
+engines = {
+    "python": generate_pyramid_for_file,
+    "gdal2tiles": generate_tiles_for_file,
+}
 
-def generate_tiles_for_city(city_folder):
-    current_date = get_current_date()
+
+def find_jobs_for_city(
+    city_folder,
+    date=None,
+    use_hash=False,
+    force=False,
+    engine=tiles_engine,
+    output=tiles_output,
+):
+    # One job per <date>/<analysis> folder whose image.tif changed since it
+    # was last tiled
     city_name = os.path.basename(city_folder)
+    date_pattern = date or "*"
+    date_folders = sorted(glob.glob(os.path.join(city_folder, date_pattern)))
 
-    date_folder = os.path.join(city_folder, current_date)
+    if not date_folders:
+        print(f"No folder found for date {date} in city folder {city_name}. Skipping...")
+        return []
 
-    if not os.path.exists(date_folder):
-        print(
-            f"No folder found for the current date {current_date} in city folder {city_name}. Skipping..."
-        )
-        return
+    jobs = []
+    for date_folder in date_folders:
+        for analysis_folder in sorted(glob.glob(os.path.join(date_folder, "*"))):
+            tif_file = os.path.join(analysis_folder, "image.tif")
+
+            if not os.path.exists(tif_file):
+                continue
+
+            fingerprint = get_fingerprint(tif_file, use_hash, engine, output)
+            if not force and read_recorded_fingerprint(analysis_folder) == fingerprint:
+                continue
+
+            jobs.append((tif_file, analysis_folder, fingerprint))
+    return jobs
 
-    for analysis_folder in glob.glob(os.path.join(date_folder, "*")):
-        tif_files = glob.glob(os.path.join(analysis_folder, "image.tif"))
 
-        if not tif_files:
-            print(f"No image.tif file found in {analysis_folder}. Skipping...")
-            continue
+def run_jobs(jobs, workers, processes, engine=tiles_engine, output=tiles_output):
+    generate = engines[engine]
+    extra_args = (output,) if engine == "python" else ()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(generate, tif_file, folder, processes, *extra_args): (
+                tif_file,
+                folder,
+                fingerprint,
+            )
+            for tif_file, folder, fingerprint in jobs
+        }
+        for future in as_completed(futures):
+            tif_file, folder, fingerprint = futures[future]
+            try:
+                returncode, elapsed = future.result()
+            except Exception as e:
+                print(f"Tiling {tif_file} raised: {e}")
+                returncode, elapsed = -1, 0.0
 
-        for tif_file in tif_files:
-            generate_tiles_for_file(tif_file, analysis_folder)
+            if returncode == 0:
+                record_fingerprint(folder, fingerprint)
+            status = "ok" if returncode == 0 else f"failed ({returncode})"
+            print(f"Tiles for {tif_file} in {folder}: {status} in {elapsed:.1f}s")
+            results.append((tif_file, returncode, elapsed))
+    return results
 
 
 def main():
-    for city_folder in glob.glob(os.path.join(data_folder, "*")):
+    parser = argparse.ArgumentParser(
+        description="Generate map tiles for every city's analysis folders."
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=tiles_jobs,
+        help="Number of files tiled in parallel.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=tiles_processes,
+        help="Threads per file for the python engine, or the value passed to "
+        "gdal2tiles --processes.",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=sorted(engines),
+        default=tiles_engine,
+        help="Build tiles in-process (python) or by running gdal2tiles.",
+    )
+    parser.add_argument(
+        "--output",
+        choices=["files", "archive"],
+        default=tiles_output,
+        help="Write one PNG per tile, or pack each pyramid into a single "
+        "tiles.archive file (python engine only).",
+    )
+    parser.add_argument(
+        "--date",
+        type=str,
+        default=None,
+        help="Only consider this week folder (YYYY-MM-DD); default is every week.",
+    )
+    parser.add_argument(
+        "--hash",
+        action="store_true",
+        help="Fingerprint image.tif by content hash instead of mtime and size.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Retile every folder even if its image.tif is unchanged.",
+    )
+    args = parser.parse_args()
+    if args.output == "archive" and args.engine != "python":
+        parser.error("--output archive requires --engine python")
+
+    jobs = []
+    for city_folder in sorted(glob.glob(os.path.join(data_folder, "*"))):
         if os.path.isdir(city_folder):
             print(f"Generating tiles for city: {city_folder}")
-            generate_tiles_for_city(city_folder)
+            jobs.extend(
+                find_jobs_for_city(
+                    city_folder,
+                    args.date,
+                    args.hash,
+                    args.force,
+                    args.engine,
+                    args.output,
+                )
+            )
+
+    if not jobs:
+        print("Nothing to tile; every image.tif matches its recorded fingerprint.")
+        return
+
+    started = time.monotonic()
+    results = run_jobs(jobs, args.jobs, args.processes, args.engine, args.output)
+    failed = [tif_file for tif_file, returncode, _ in results if returncode != 0]
+    print(
+        f"Tiled {len(results) - len(failed)} of {len(results)} files "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+import numpy as np
+
+# NumPy versions of the index math in gee/. Every function takes a dict of
+# band name -> float32 array, with NaN where a pixel is masked (nodata or
+# rejected by a QA mask), and follows the Earth Engine expression it mirrors,
+# so locally built composites match the exported ones.
+
+
+def mask_s2_clouds(bands):
+    # gee/ndvi.py: drop opaque cloud (bit 10) and cirrus (bit 11) pixels and
+    # scale to reflectance
+    qa = np.nan_to_num(bands["QA60"]).astype(np.uint16)
+    clear = ((qa & (1 << 10)) == 0) & ((qa & (1 << 11)) == 0)
+    return {
+        name: np.where(clear, band / 10000, np.nan).astype(np.float32)
+        for name, band in bands.items()
+    }
+
+
+def mask_invalid_pixels(bands):
+    # gee/lst.py: same QA_PIXEL bits as the Earth Engine script
+    qa = np.nan_to_num(bands["QA_PIXEL"]).astype(np.uint16)
+    clear = ((qa & (1 << 5)) == 0) & ((qa & (1 << 3)) == 0)
+    return {
+        name: np.where(clear, band, np.nan).astype(np.float32)
+        for name, band in bands.items()
+    }
+
+
+def normalized_difference(first, second):
+    # ee.Image.normalizedDifference masks pixels where either input is
+    # negative
+    total = first + second
+    valid = (first >= 0) & (second >= 0) & (total != 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = (first - second) / total
+    return np.where(valid, result, np.nan).astype(np.float32)
+
+
+def calculate_ndvi(bands):
+    return normalized_difference(bands["B8"], bands["B4"])
+
+
+def calculate_ndbi(bands):
+    return normalized_difference(bands["B11"], bands["B8"])
+
+
+def calculate_albedo(bands):
+    # Weighted band coefficients from gee/albedo.py (Liu et al., 2020)
+    return (
+        bands["B2"] * 0.279
+        + bands["B3"] * 0.192
+        + bands["B4"] * 0.119
+        + bands["B8"] * 0.093
+        + bands["B11"] * 0.043
+        + bands["B12"] * 0.017
+    ).astype(np.float32)
+
+
+def calculate_lst(bands):
+    # Landsat Collection 2 surface temperature to degrees Celsius
+    return (bands["ST_B10"] * 0.00341802 + 149.0 - 273.15).astype(np.float32)
+
+
+# Sensor -> (QA band, mask function)
+sensors = {
+    "s2": ("QA60", mask_s2_clouds),
+    "landsat": ("QA_PIXEL", mask_invalid_pixels),
+}
+
+# Analysis -> (sensor, bands read besides the QA band, index function)
+indices = {
+    "ndvi": ("s2", ["B4", "B8"], calculate_ndvi),
+    "ndbi": ("s2", ["B8", "B11"], calculate_ndbi),
+    "albedo": ("s2", ["B2", "B3", "B4", "B8", "B11", "B12"], calculate_albedo),
+    "lst": ("landsat", ["ST_B10"], calculate_lst),
+}
+
+
+def required_bands(analysis):
+    sensor, bands, _ = indices[analysis]
+    qa_band, _ = sensors[sensor]
+    return bands + [qa_band]
+
+
+def compute_index(analysis, bands):
+    # Mask, then compute, exactly like collection.map(mask).map(calculate)
+    sensor, _, calculate = indices[analysis]
+    _, mask = sensors[sensor]
+    return calculate(mask(bands))
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import hashlib
+import datetime
+
+# Local record of every Drive export that has been synced, so a sync run
+# fetches only files whose Drive revision changed. The size and md5 of the
+# local file as written (after COG conversion) are recorded too, so a local
+# file that was truncated or corrupted since is fetched again.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    modified_time TEXT,
+    md5 TEXT,
+    size INTEGER,
+    local_path TEXT NOT NULL,
+    local_size INTEGER,
+    local_md5 TEXT,
+    synced_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+# Columns added after the first release, for manifests created before them
+added_columns = {"local_size": "INTEGER", "local_md5": "TEXT"}
+
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def open_manifest(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(files)")}
+    for name, column_type in added_columns.items():
+        if name not in columns:
+            conn.execute(f"ALTER TABLE files ADD COLUMN {name} {column_type}")
+    conn.commit()
+    return conn
+
+
+def file_md5(path, chunk_size=1024 * 1024):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_entry(conn, file_id):
+    return conn.execute("SELECT * FROM files WHERE file_id = ?", (file_id,)).fetchone()
+
+
+def needs_sync(conn, item, destination, verify=False):
+    # True when the Drive file changed or the local copy no longer matches
+    # what was written; verify also compares the md5 of the local file
+    entry = get_entry(conn, item["id"])
+    if entry is None or not os.path.exists(destination):
+        return True
+    if entry["local_path"] != destination:
+        return True
+    if item.get("md5Checksum") and item["md5Checksum"] != entry["md5"]:
+        return True
+    if item.get("modifiedTime") != entry["modified_time"]:
+        return True
+    local_size = entry["local_size"]
+    if local_size is not None and os.path.getsize(destination) != local_size:
+        return True
+    local_md5 = entry["local_md5"]
+    return verify and local_md5 is not None and file_md5(destination) != local_md5
+
+
+def record_file(conn, item, destination):
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO files
+            (file_id, name, modified_time, md5, size, local_path,
+             local_size, local_md5, synced_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            item["id"],
+            item["name"],
+            item.get("modifiedTime"),
+            item.get("md5Checksum"),
+            int(item["size"]) if "size" in item else None,
+            destination,
+            os.path.getsize(destination),
+            file_md5(destination),
+            utc_now(),
+        ),
+    )
+    conn.commit()
+
+
+def get_last_sync(conn):
+    row = conn.execute(
+        "SELECT value FROM sync_state WHERE key = 'last_sync'"
+    ).fetchone()
+    return row["value"] if row else None
+
+
+def set_last_sync(conn, value):
+    conn.execute(
+        "INSERT OR REPLACE INTO sync_state (key, value) VALUES ('last_sync', ?)",
+        (value,),
+    )
+    conn.commit()
+
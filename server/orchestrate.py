@@ -0,0 +1,295 @@
+import os
+import sys
+import datetime
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from composite import week_start_for
+from generate_tiles import matches_recorded_fingerprint
+from gee.job_config import jobs_config_path, load_job_config, period_end, select_cities
+from gee.planner import load_empty_weeks, plan_week_dates
+
+# Runs the whole pipeline for the cities, period and analyses in jobs.json:
+# the GEE export scripts, then download.py, then uhi.py for cities exporting
+# lst for local UHI, then generate_tiles.py. Every
+# city x week x analysis cell is checked against the data folder first and a
+# stage only runs for what is still missing, e.g.
+#
+#     python orchestrate.py --dry-run
+#     python orchestrate.py --stages gee --cities riyadh jiddah
+
+load_dotenv()
+
+data_folder = os.getenv("DATAPATH", "data")
+gee_jobs = int(os.getenv("ORCHESTRATE_GEE_JOBS", 2))
+# Compute UHI with uhi.py from exported lst images, for every city listing uhi
+uhi_local = os.getenv("UHI_LOCAL", "0") == "1"
+server_folder = os.path.dirname(os.path.abspath(__file__))
+gee_folder = os.path.join(server_folder, "gee")
+
+stages = ["gee", "download", "uhi", "tiles"]
+
+# Analysis -> (export script, extra environment)
+gee_scripts = {
+    "um": ("urbanmask.py", {}),
+    "uhi": ("lst.py", {}),
+    "lst": ("lst.py", {"UHI_LOCAL": "1"}),
+    "ndvi": ("ndvi.py", {}),
+    "ndbi": ("ndbi.py", {}),
+    "albedo": ("albedo.py", {}),
+}
+# Analyses that s2_indices.py exports from one composite
+s2_analyses = {"ndvi", "ndbi", "albedo"}
+
+MISSING, EMPTY, DOWNLOADED, TILED = "missing", "empty", "downloaded", "tiled"
+
+
+def cell_state(analysis_folder):
+    tif_file = os.path.join(analysis_folder, "image.tif")
+    if not os.path.exists(tif_file):
+        return MISSING
+    if matches_recorded_fingerprint(analysis_folder, tif_file):
+        return TILED
+    return DOWNLOADED
+
+
+def plan_cells(config, cities, analyses, folder=data_folder):
+    # Exports of a week land in the folder of the Sunday that starts it, the
+    # same way download.py files them. Missing weeks the export scripts found
+    # no images for are empty rather than missing, so they are not exported
+    # again on every run.
+    week_dates = plan_week_dates(period_end(config), config["months"])
+    cells = []
+    for city in cities:
+        for analysis in city["analyses"]:
+            if analysis not in analyses:
+                continue
+            empty_weeks = set(load_empty_weeks(city["clean_name"], analysis))
+            for start, _ in week_dates:
+                week = week_start_for(datetime.date.fromisoformat(start)).isoformat()
+                analysis_folder = os.path.join(folder, city["clean_name"], week, analysis)
+                state = cell_state(analysis_folder)
+                if state == MISSING and start in empty_weeks:
+                    state = EMPTY
+                cells.append({
+                    "city": city["clean_name"],
+                    "week": week,
+                    "analysis": analysis,
+                    "state": state,
+                })
+    return cells
+
+
+def print_summary(cells):
+    counts = {}
+    for cell in cells:
+        states = counts.setdefault((cell["city"], cell["analysis"]), {})
+        states[cell["state"]] = states.get(cell["state"], 0) + 1
+    for (city, analysis), states in sorted(counts.items()):
+        summary = ", ".join(f"{states.get(state, 0)} {state}" for state in (TILED, DOWNLOADED, MISSING, EMPTY))
+        print(f"{city:24} {analysis:8} {summary}")
+
+
+def plan_gee_runs(cells, local_uhi=False):
+    # (script, extra environment, cities) for every export script that has
+    # missing cells. Cities missing all three S2 indices get them from one
+    # s2_indices.py run instead of three scripts. With local UHI the uhi
+    # cells are left to uhi.py and only their lst is exported.
+    missing = {}
+    for cell in cells:
+        if cell["state"] == MISSING:
+            missing.setdefault(cell["city"], set()).add(cell["analysis"])
+
+    runs = {}
+    for city, analyses in sorted(missing.items()):
+        if local_uhi:
+            analyses = analyses - {"uhi"}
+        if s2_analyses <= analyses:
+            runs.setdefault(("s2_indices.py", ()), []).append(city)
+            analyses = analyses - s2_analyses
+        for analysis in sorted(analyses):
+            script, env = gee_scripts[analysis]
+            runs.setdefault((script, tuple(sorted(env.items()))), []).append(city)
+
+    return [(script, dict(env), cities) for (script, env), cities in runs.items()]
+
+
+def run_script(args, cwd, env=None):
+    print(f"Running {' '.join(args)}")
+    result = subprocess.run(
+        [sys.executable, *args], cwd=cwd, env={**os.environ, **(env or {})}
+    )
+    if result.returncode != 0:
+        print(f"{' '.join(args)} exited with {result.returncode}")
+    return result.returncode
+
+
+def run_gee_stage(cells, jobs, force=False, local_uhi=False):
+    runs = plan_gee_runs(cells, local_uhi)
+    if not runs:
+        print("GEE: every cell has been exported")
+        return True
+
+    def run(script_run):
+        script, env, cities = script_run
+        env = {**env, "JOB_CITIES": ",".join(cities)}
+        if force:
+            env["EXPORT_FORCE"] = "1"
+        return run_script([script], gee_folder, env)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return all(code == 0 for code in executor.map(run, runs))
+
+
+def run_download_stage(cells, workers=None):
+    if all(cell["state"] != MISSING for cell in cells):
+        print("Download: every cell has been downloaded")
+        return True
+    args = ["download.py"]
+    analyses = {cell["analysis"] for cell in cells}
+    if len(analyses) == 1:
+        args += ["--analysis", analyses.pop()]
+    if workers:
+        args += ["--workers", str(workers)]
+    return run_script(args, server_folder) == 0
+
+
+def with_local_uhi(cities, analyses):
+    # Cities listing uhi also get lst cells, which lst.py exports with
+    # UHI_LOCAL=1 for uhi.py
+    cities = [
+        {**city, "analyses": [*city["analyses"], "lst"]}
+        if "uhi" in city["analyses"] and "lst" not in city["analyses"]
+        else city
+        for city in cities
+    ]
+    if "uhi" in analyses:
+        analyses = analyses | {"lst"}
+    return cities, analyses
+
+
+def local_uhi_cities(cities, analyses):
+    # Cities that export lst with UHI_LOCAL=1 and get UHI from uhi.py
+    if "lst" not in analyses:
+        return []
+    return [city["clean_name"] for city in cities if "lst" in city["analyses"]]
+
+
+def run_uhi_stage(cities, force=False):
+    # uhi.py skips weeks whose outputs are newer than their lst and um
+    ok = True
+    for city in cities:
+        args = ["uhi.py", "--city", city, "--folder", data_folder]
+        if force:
+            args.append("--force")
+        ok = run_script(args, server_folder) == 0 and ok
+    return ok
+
+
+def run_tiles_stage(cells, jobs=None, force=False, local_uhi=False):
+    # uhi folders of local UHI are not cells, so tiling runs whenever there
+    # may be new ones; generate_tiles.py skips the folders already tiled
+    if not (force or local_uhi) and all(cell["state"] != DOWNLOADED for cell in cells):
+        print("Tiles: every downloaded cell has been tiled")
+        return True
+    args = ["generate_tiles.py"]
+    if jobs:
+        args += ["--jobs", str(jobs)]
+    if force:
+        args.append("--force")
+    return run_script(args, server_folder) == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export, download and tile every city, week and analysis "
+        "of the job configuration."
+    )
+    parser.add_argument("--config", type=str, default=jobs_config_path)
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=stages,
+        default=stages,
+        help="Stages to run, in pipeline order.",
+    )
+    parser.add_argument(
+        "--cities",
+        nargs="+",
+        default=None,
+        help="City folder names to process (default: every configured city).",
+    )
+    parser.add_argument(
+        "--analyses",
+        nargs="+",
+        default=None,
+        help="Analyses to process (default: the configured analyses).",
+    )
+    parser.add_argument(
+        "--gee-jobs",
+        type=int,
+        default=gee_jobs,
+        help="Export scripts run at the same time.",
+    )
+    parser.add_argument("--download-workers", type=int, default=None)
+    parser.add_argument("--tile-jobs", type=int, default=None)
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Export and tile again even when a cell is already complete.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only print the state of every cell.",
+    )
+    args = parser.parse_args()
+
+    config = load_job_config(args.config)
+    names = ",".join(args.cities) if args.cities else ""
+    cities = select_cities(config, names=names)
+    analyses = set(args.analyses or {a for city in cities for a in city["analyses"]})
+    unknown = analyses - set(gee_scripts)
+    if unknown:
+        parser.error(f"Unknown analyses: {', '.join(sorted(unknown))}")
+    if uhi_local:
+        cities, analyses = with_local_uhi(cities, analyses)
+
+    cells = plan_cells(config, cities, analyses)
+    uhi_cities = local_uhi_cities(cities, analyses)
+    print_summary(cells)
+    if args.dry_run:
+        return
+
+    # The children read the same configuration
+    os.environ["JOBS_CONFIG"] = os.path.abspath(args.config)
+
+    ok = True
+    for stage in stages:
+        if stage not in args.stages:
+            continue
+        if stage == "gee":
+            if args.force:
+                gee_cells = [{**cell, "state": MISSING} for cell in cells]
+            else:
+                gee_cells = cells
+            ok = run_gee_stage(gee_cells, args.gee_jobs, args.force, uhi_local) and ok
+        elif stage == "download":
+            ok = run_download_stage(cells, args.download_workers) and ok
+        elif stage == "uhi":
+            ok = run_uhi_stage(uhi_cities, args.force) and ok
+        elif stage == "tiles":
+            local_uhi = bool(uhi_cities) and "uhi" in args.stages
+            ok = run_tiles_stage(cells, args.tile_jobs, args.force, local_uhi) and ok
+        # Later stages see what this one produced
+        cells = plan_cells(config, cities, analyses)
+
+    print_summary(cells)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import numpy as np
+
+# Visualization parameters mirrored from the GEE scripts in gee/ so that tiles
+# rendered by the server look the same as the layers Earth Engine displays.
+# The gee/ modules authenticate against Earth Engine on import, so the values
+# are copied here rather than imported.
+lst_vis_params = {
+    'min': 0,
+    'max': 50,
+    'palette': ['blue', 'green', 'yellow', 'red']
+}
+uhi_vis_params = {
+    'min': -5,
+    'max': 5,
+    'palette': ['blue', 'white', 'red']
+}
+ndvi_params = {
+    'min': 0,
+    'max': 1,
+    'palette': ['blue', 'yellow', 'green']
+}
+ndbi_params = {
+    'min': 0,
+    'max': 1,
+    'palette': ['lightblue', 'yellow', 'darkred']
+}
+albedo_params = {
+    'min': 0,
+    'max': 1,
+    'palette': ['blue', 'green', 'yellow', 'red']
+}
+# Same colors the client uses for the urban mask legend
+um_params = {
+    'min': 0,
+    'max': 1,
+    'palette': ['gray', 'green']
+}
+
+# Night light radiance (nW/cm2/sr) behind the urban mask
+radiance_params = {
+    'min': 0,
+    'max': 60,
+    'palette': ['black', 'purple', 'orange', 'yellow']
+}
+
+vis_params = {
+    "lst": lst_vis_params,
+    "uhi": uhi_vis_params,
+    "ndvi": ndvi_params,
+    "ndbi": ndbi_params,
+    "albedo": albedo_params,
+    "um": um_params,
+    "radiance": radiance_params,
+}
+
+# Analyses holding class values rather than continuous measurements
+categorical = {"um"}
+
+# CSS color names used by the palettes above
+colors = {
+    "blue": (0, 0, 255),
+    "lightblue": (173, 216, 230),
+    "green": (0, 128, 0),
+    "darkgreen": (0, 100, 0),
+    "yellow": (255, 255, 0),
+    "red": (255, 0, 0),
+    "darkred": (139, 0, 0),
+    "white": (255, 255, 255),
+    "gray": (128, 128, 128),
+    "darkgray": (169, 169, 169),
+    "brown": (165, 42, 42),
+    "black": (0, 0, 0),
+    "purple": (128, 0, 128),
+    "orange": (255, 165, 0),
+}
+
+_luts = {}
+
+
+def get_lut(palette_name):
+    # 256-entry RGBA lookup table, interpolated linearly between the palette
+    # stops the same way Earth Engine stretches a palette over [min, max]
+    if palette_name not in _luts:
+        palette = vis_params[palette_name]["palette"]
+        stops = np.array([colors[name] for name in palette], dtype="float64")
+        positions = np.linspace(0, 255, len(stops))
+        lut = np.full((256, 4), 255, dtype="uint8")
+        for channel in range(3):
+            lut[:, channel] = np.round(
+                np.interp(np.arange(256), positions, stops[:, channel])
+            )
+        _luts[palette_name] = lut
+    return _luts[palette_name]
@@ -0,0 +1,172 @@
+import json
+import struct
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.errors import RasterioIOError
+from rasterio.transform import array_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+from palettes import categorical
+
+# Downsampled previews of an image.tif for the client to draw the whole city
+# at once instead of parsing the full resolution GeoTIFF. Reads are decimated
+# by GDAL, which uses the COG overviews when there are any.
+#
+# A preview is sent as one binary payload:
+#
+#     uint32 little-endian header length
+#     JSON header, padded with spaces so the arrays start 8-byte aligned
+#     one little-endian height x width array per band, row major
+#
+# The header holds the grid ("width", "height", "crs", "transform", "bounds"
+# in the image CRS and "bounds_wgs84"), the array "dtype" and one entry per
+# band with its "name", "scale", "offset" and "nodata". Quantized values
+# decode as offset + value * scale; float32 arrays use NaN for nodata.
+#
+# Bundles use the same layout with one band per week, all on the grid of the
+# first week, so the client gets a whole slider animation from one request.
+
+HEADER_LENGTH = struct.Struct("<I")
+
+# dtype -> nodata value of the quantized arrays, the top of their range
+quantized_dtypes = {"uint8": 255, "uint16": 65535}
+preview_dtypes = ["float32", *quantized_dtypes]
+
+
+def preview_shape(src_width, src_height, width, height):
+    # (rows, cols) that fit in width x height with the image aspect ratio,
+    # never larger than the image itself
+    factor = max(src_width / width, src_height / height, 1)
+    return (
+        max(1, round(src_height / factor)),
+        max(1, round(src_width / factor)),
+    )
+
+
+def preview_grid(src, width, height):
+    # (crs, transform, shape) of the image decimated to fit width x height
+    shape = preview_shape(src.width, src.height, width, height)
+    transform = src.transform * src.transform.scale(
+        src.width / shape[1], src.height / shape[0]
+    )
+    return src.crs, transform, shape
+
+
+def read_preview(src, grid, resampling):
+    # Float32 array of the first band on grid, and where it is valid. Images
+    # already on the grid are decimated reads; others are warped onto it.
+    crs, transform, shape = grid
+    same_bounds = np.allclose(
+        src.bounds, array_bounds(*shape, transform), rtol=0, atol=abs(transform.a) / 2
+    )
+    if src.crs == crs and same_bounds:
+        data = src.read(
+            1, out_shape=shape, resampling=resampling, out_dtype="float32", masked=True
+        )
+        valid = ~np.ma.getmaskarray(data) & np.isfinite(data.data)
+        return data.data, valid
+
+    with WarpedVRT(
+        src,
+        crs=crs,
+        transform=transform,
+        width=shape[1],
+        height=shape[0],
+        resampling=resampling,
+        add_alpha=True,
+    ) as vrt:
+        data = vrt.read(1, out_dtype="float32")
+        alpha = vrt.read(vrt.count)
+    return data, (alpha > 0) & np.isfinite(data)
+
+
+def preview_resampling(analysis):
+    # Same as the COG overviews: classes are picked, values are averaged
+    return Resampling.nearest if analysis in categorical else Resampling.average
+
+
+def quantize(data, valid, dtype):
+    # (array, band) with the valid values scaled to the range of dtype
+    if dtype == "float32":
+        return np.where(valid, data, np.nan).astype("<f4"), {
+            "scale": 1.0,
+            "offset": 0.0,
+            "nodata": None,
+        }
+
+    nodata = quantized_dtypes[dtype]
+    quantized = np.full(data.shape, nodata, dtype=np.dtype(dtype).newbyteorder("<"))
+    if not valid.any():
+        return quantized, {"scale": 1.0, "offset": 0.0, "nodata": nodata}
+
+    low = float(data[valid].min())
+    high = float(data[valid].max())
+    scale = (high - low) / (nodata - 1) or 1.0
+    quantized[valid] = np.round((data[valid] - low) / scale)
+    return quantized, {"scale": scale, "offset": low, "nodata": nodata}
+
+
+def grid_header(crs, transform, shape):
+    height, width = shape
+    bounds = array_bounds(height, width, transform)
+    return {
+        "width": width,
+        "height": height,
+        "crs": crs.to_string(),
+        "transform": list(transform)[:6],
+        "bounds": list(bounds),
+        "bounds_wgs84": list(transform_bounds(crs, "EPSG:4326", *bounds)),
+    }
+
+
+def pack(header, arrays):
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b" " * (-(HEADER_LENGTH.size + len(header_bytes)) % 8)
+    return b"".join(
+        [HEADER_LENGTH.pack(len(header_bytes)), header_bytes]
+        + [array.tobytes() for array in arrays]
+    )
+
+
+def render_preview(tif_path, width, height, dtype="float32", analysis=None):
+    with rasterio.open(tif_path) as src:
+        grid = preview_grid(src, width, height)
+        data, valid = read_preview(src, grid, preview_resampling(analysis))
+
+    array, band = quantize(data, valid, dtype)
+    header = grid_header(*grid)
+    header["dtype"] = dtype
+    header["bands"] = [{"name": analysis, **band}]
+    return pack(header, [array])
+
+
+def render_bundle(tif_paths, names, width, height, dtype="uint8", analysis=None):
+    # One band per readable image, named by names, on the grid of the first
+    # readable image. Each band is quantized with its own scale and offset.
+    resampling = preview_resampling(analysis)
+    grid = None
+    arrays = []
+    bands = []
+    for tif_path, name in zip(tif_paths, names):
+        try:
+            with rasterio.open(tif_path) as src:
+                if grid is None:
+                    grid = preview_grid(src, width, height)
+                data, valid = read_preview(src, grid, resampling)
+        except RasterioIOError as e:
+            print(f"Leaving {tif_path} out of the bundle: {e}")
+            continue
+        array, band = quantize(data, valid, dtype)
+        arrays.append(array)
+        bands.append({"name": name, **band})
+
+    if grid is None:
+        raise RasterioIOError("None of the images could be read")
+
+    header = grid_header(*grid)
+    header["dtype"] = dtype
+    header["bands"] = bands
+    return pack(header, arrays)
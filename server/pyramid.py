@@ -0,0 +1,222 @@
+import os
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.warp import reproject, transform_bounds
+
+from palettes import categorical, vis_params
+from tile_archive import ARCHIVE_NAME, TileArchiveWriter
+from tiler import ORIGIN_SHIFT, TILE_SIZE, WEB_MERCATOR, colorize, encode_png
+
+# In-process replacement for gdal2tiles. The GeoTIFF is read and warped to
+# web mercator once, at the zoom level closest to its native resolution.
+# Every shallower level is built by 2x2 downsampling of the level below it
+# and every deeper level by pixel replication of the base level, so the
+# source raster is never resampled more than once.
+
+
+def parse_zoom_range(tiles_level):
+    min_zoom, _, max_zoom = tiles_level.partition("-")
+    return int(min_zoom), int(max_zoom or min_zoom)
+
+
+def zoom_resolution(z):
+    return 2 * ORIGIN_SHIFT / TILE_SIZE / (2**z)
+
+
+def tile_range(bounds, z):
+    # Tiles at zoom z, in XYZ numbering, covering the web mercator bounds
+    left, bottom, right, top = bounds
+    span = 2 * ORIGIN_SHIFT / (2**z)
+    last = 2**z - 1
+    x0 = min(max(int((left + ORIGIN_SHIFT) // span), 0), last)
+    x1 = min(max(int((right + ORIGIN_SHIFT) // span), 0), last)
+    y0 = min(max(int((ORIGIN_SHIFT - top) // span), 0), last)
+    y1 = min(max(int((ORIGIN_SHIFT - bottom) // span), 0), last)
+    return x0, y0, x1, y1
+
+
+def read_base_level(src, z, resampling):
+    bounds = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds)
+    x0, y0, x1, y1 = tile_range(bounds, z)
+    span = 2 * ORIGIN_SHIFT / (2**z)
+    res = zoom_resolution(z)
+    shape = ((y1 - y0 + 1) * TILE_SIZE, (x1 - x0 + 1) * TILE_SIZE)
+    dst_transform = from_origin(
+        -ORIGIN_SHIFT + x0 * span, ORIGIN_SHIFT - y0 * span, res, res
+    )
+
+    if src.nodata is not None:
+        src_nodata = src.nodata
+    elif np.issubdtype(np.dtype(src.dtypes[0]), np.floating):
+        src_nodata = np.nan
+    else:
+        src_nodata = None
+
+    level = np.full(shape, np.nan, dtype="float32")
+    reproject(
+        source=rasterio.band(src, 1),
+        destination=level,
+        src_nodata=src_nodata,
+        dst_transform=dst_transform,
+        dst_crs=WEB_MERCATOR,
+        dst_nodata=np.nan,
+        resampling=resampling,
+    )
+    return level, x0, y0
+
+
+def pad_to_even_tiles(level, x0, y0):
+    # A parent tile covers a 2x2 block of child tiles starting at even
+    # indices, so pad the level with empty tiles until it is aligned
+    pad_left = TILE_SIZE if x0 % 2 else 0
+    pad_top = TILE_SIZE if y0 % 2 else 0
+    tiles_x = (level.shape[1] + pad_left) // TILE_SIZE
+    tiles_y = (level.shape[0] + pad_top) // TILE_SIZE
+    pad_right = TILE_SIZE if tiles_x % 2 else 0
+    pad_bottom = TILE_SIZE if tiles_y % 2 else 0
+
+    if pad_left or pad_top or pad_right or pad_bottom:
+        level = np.pad(
+            level,
+            ((pad_top, pad_bottom), (pad_left, pad_right)),
+            constant_values=np.nan,
+        )
+    return level, x0 - (1 if pad_left else 0), y0 - (1 if pad_top else 0)
+
+
+def downsample(level, x0, y0, is_categorical):
+    level, x0, y0 = pad_to_even_tiles(level, x0, y0)
+    height, width = level.shape
+
+    if is_categorical:
+        # Averaging class values would invent classes; keep one of the four
+        return level[::2, ::2], x0 // 2, y0 // 2
+
+    blocks = level.reshape(height // 2, 2, width // 2, 2)
+    valid = ~np.isnan(blocks)
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        parent = (total / count).astype("float32")
+    return parent, x0 // 2, y0 // 2
+
+
+def iter_level_tiles(level, x0, y0, z):
+    tiles_y, tiles_x = level.shape[0] // TILE_SIZE, level.shape[1] // TILE_SIZE
+    for row in range(tiles_y):
+        for col in range(tiles_x):
+            data = level[
+                row * TILE_SIZE : (row + 1) * TILE_SIZE,
+                col * TILE_SIZE : (col + 1) * TILE_SIZE,
+            ]
+            yield z, x0 + col, y0 + row, data
+
+
+def iter_deep_tiles(base, x0, y0, base_zoom, z):
+    # Tiles deeper than the base level replicate base pixels, which is all
+    # the detail the source raster has at those zooms
+    factor = 2 ** (z - base_zoom)
+    block = TILE_SIZE // factor
+    tiles_y, tiles_x = base.shape[0] // block, base.shape[1] // block
+    for row in range(tiles_y):
+        for col in range(tiles_x):
+            data = base[row * block : (row + 1) * block, col * block : (col + 1) * block]
+            data = np.repeat(np.repeat(data, factor, axis=0), factor, axis=1)
+            yield z, x0 * factor + col, y0 * factor + row, data
+
+
+def tile_path(tiles_folder_path, z, x, y, tms):
+    if tms:
+        y = 2**z - 1 - y
+    return os.path.join(tiles_folder_path, str(z), str(x), f"{y}.png")
+
+
+def render_pyramid_tile(data, palette_name):
+    valid = ~np.isnan(data)
+    if not valid.any():
+        return None
+    return encode_png(colorize(data, valid, palette_name))
+
+
+def iter_pyramid(tif_file_path, tiles_level, palette_name):
+    # Yields (z, x, y, data) for every tile of the pyramid, deepest first
+    min_zoom, max_zoom = parse_zoom_range(tiles_level)
+    is_categorical = palette_name in categorical
+    resampling = Resampling.nearest if is_categorical else Resampling.bilinear
+
+    with rasterio.open(tif_file_path) as src:
+        left, bottom, right, top = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds)
+        native_res = max((right - left) / src.width, (top - bottom) / src.height)
+        native_zoom = round(math.log2(zoom_resolution(0) / native_res))
+        base_zoom = min(max(native_zoom, min_zoom), max_zoom)
+        level, x0, y0 = read_base_level(src, base_zoom, resampling)
+
+    for z in range(max_zoom, base_zoom, -1):
+        if 2 ** (z - base_zoom) <= TILE_SIZE:
+            yield from iter_deep_tiles(level, x0, y0, base_zoom, z)
+
+    z = base_zoom
+    while True:
+        yield from iter_level_tiles(level, x0, y0, z)
+        if z == min_zoom:
+            break
+        level, x0, y0 = downsample(level, x0, y0, is_categorical)
+        z -= 1
+
+
+def render_pyramid(tif_file_path, tiles_level, palette_name, workers=1):
+    # Yields (z, x, y, png) for every non-empty tile. Tiles are rendered by
+    # a thread pool in bounded batches so upsampled deep tiles are not all
+    # held in memory at once.
+    def render(tile):
+        z, x, y, data = tile
+        return z, x, y, render_pyramid_tile(data, palette_name)
+
+    batch = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for tile in iter_pyramid(tif_file_path, tiles_level, palette_name):
+            batch.append(tile)
+            if len(batch) >= workers * 16:
+                yield from (t for t in executor.map(render, batch) if t[3] is not None)
+                batch = []
+        yield from (t for t in executor.map(render, batch) if t[3] is not None)
+
+
+def get_palette_name(tiles_folder_path):
+    palette_name = os.path.basename(os.path.normpath(tiles_folder_path))
+    if palette_name not in vis_params:
+        raise ValueError(f"No palette for analysis folder {tiles_folder_path}")
+    return palette_name
+
+
+def build_pyramid(tif_file_path, tiles_folder_path, tiles_level, workers=1, tms=True):
+    # Tiles are written as {z}/{x}/{y}.png, with TMS row numbering by default
+    # like gdal2tiles
+    palette_name = get_palette_name(tiles_folder_path)
+    written = 0
+    for z, x, y, png in render_pyramid(tif_file_path, tiles_level, palette_name, workers):
+        path = tile_path(tiles_folder_path, z, x, y, tms)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(png)
+        written += 1
+    return written
+
+
+def build_pyramid_archive(tif_file_path, tiles_folder_path, tiles_level, workers=1):
+    # Same pyramid packed into a single tile archive, in XYZ numbering
+    palette_name = get_palette_name(tiles_folder_path)
+    archive_path = os.path.join(tiles_folder_path, ARCHIVE_NAME)
+    written = 0
+    with TileArchiveWriter(archive_path) as writer:
+        for z, x, y, png in render_pyramid(
+            tif_file_path, tiles_level, palette_name, workers
+        ):
+            writer.add(z, x, y, png)
+            written += 1
+    return written
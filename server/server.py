@@ -1,21 +1,109 @@
 import os
 import json
+import gzip
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pathlib import Path
-import geojson
+import numpy as np
+from rasterio.errors import RasterioIOError
+
+from catalog import Catalog
+from file_serving import (
+    cache_control_for,
+    etag_matches,
+    file_etag,
+    iter_range,
+    media_types,
+    parse_range,
+    resolve_path,
+)
+from palettes import vis_params
+from preview import preview_dtypes, render_bundle, render_preview
+from stats_index import StatsIndex
+from tile_archive import ARCHIVE_NAME, open_archive
+from tile_cache import TileCache
+from tiler import is_valid_tile, render_tile
+from watcher import TreeWatcher
+from zonal import ZonalEngine, districts_path, zonal_stats
 
 load_dotenv()
 
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 TILES_BASE_DIR = os.getenv("TILES_BASE_DIR", "data/tiles")
 ALLOW_ORIGINS = json.loads(os.getenv("ALLOW_ORIGINS", '["*"]'))
+TILE_CACHE_BYTES = int(os.getenv("TILE_CACHE_BYTES", 64 * 1024 * 1024))
+STATS_REFRESH_SECONDS = int(os.getenv("STATS_REFRESH_SECONDS", 30))
+CATALOG_REFRESH_SECONDS = int(os.getenv("CATALOG_REFRESH_SECONDS", 30))
+PREVIEW_MAX_SIZE = int(os.getenv("PREVIEW_MAX_SIZE", 2048))
+BUNDLE_MAX_WEEKS = int(os.getenv("BUNDLE_MAX_WEEKS", 52))
+# width x height x weeks of a bundle, which bounds the arrays held while it
+# is built (64 MB at float32)
+BUNDLE_MAX_PIXELS = int(os.getenv("BUNDLE_MAX_PIXELS", 2**24))
+# auto (inotify, else polling), inotify, poll or off
+WATCH_MODE = os.getenv("WATCH_MODE", "auto")
+WATCH_POLL_SECONDS = float(os.getenv("WATCH_POLL_SECONDS", 5))
+
+stats_index = StatsIndex(TILES_BASE_DIR, STATS_REFRESH_SECONDS)
+catalog = Catalog(TILES_BASE_DIR, CATALOG_REFRESH_SECONDS)
+tile_cache = TileCache(TILE_CACHE_BYTES)
+zonal_engine = ZonalEngine()
+
+
+def apply_file_change(path, removed):
+    # Called from the watcher thread for every new, replaced or removed
+    # <city>/<date>/<analysis>/image.tif or stats.geojson
+    rel_path = os.path.relpath(path, TILES_BASE_DIR)
+    city, date, analysis, name = rel_path.split(os.sep)
+    if name == "image.tif":
+        if removed:
+            catalog.remove_file(path)
+        else:
+            catalog.update_file(path)
+        tile_cache.invalidate(city.lower(), date, analysis)
+    elif removed:
+        stats_index.remove_file(path)
+    else:
+        stats_index.update_file(path)
+
+
+def rescan_tree():
+    catalog.refresh()
+    stats_index.refresh()
+    tile_cache.clear()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    watcher = None
+    if WATCH_MODE != "off":
+        # Started before the first scan so nothing written in between is missed
+        watcher = TreeWatcher(
+            TILES_BASE_DIR,
+            apply_file_change,
+            rescan_tree,
+            mode=WATCH_MODE,
+            poll_interval=WATCH_POLL_SECONDS,
+        )
+        await run_in_threadpool(watcher.start)
+        # Requests no longer need to rescan the tree themselves
+        catalog.refresh_interval = float("inf")
+        stats_index.refresh_interval = float("inf")
+
+    await run_in_threadpool(catalog.refresh)
+    await run_in_threadpool(stats_index.refresh)
+    yield
+
+    if watcher is not None:
+        await run_in_threadpool(watcher.stop)
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,52 +111,314 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stats-Dates"],
 )
 
-app.mount("/tiles", StaticFiles(directory=TILES_BASE_DIR, html=False), name="tiles")
-app.mount("/static", StaticFiles(directory="static/static"), name="static")
-cities = {
-    "riyadh": {"lat": 24.7136, "lng": 46.6753},
-}
 
-@app.get("/{full_path:path}")
-async def serve_react_app(full_path: str):
-    return FileResponse(Path("static/index.html"))
+def check_city(city):
+    if not catalog.has_city(city):
+        raise HTTPException(status_code=400, detail=f"Invalid city name: {city}")
+
+
+@app.get("/catalog")
+async def get_catalog():
+    return catalog.to_dict()
+
 
 @app.get("/get-analysis/{city}/{date}/{analysis}")
 async def get_geotiff_tile(city: str, date: str, analysis: str):
     city = city.lower()
-    if city not in cities:
-        raise HTTPException(status_code=400, detail=f"Invalid city name: {city}")
-
-    tiff_rel_path = os.path.join(city, date, analysis, "image.tif")
-    tiff_abs_path = os.path.join(TILES_BASE_DIR, tiff_rel_path)
+    check_city(city)
 
-    if not os.path.exists(tiff_abs_path):
+    if catalog.image_mtime(city, date, analysis) is None:
         raise HTTPException(status_code=404, detail="GeoTIFF tile not found.")
 
+    tiff_rel_path = os.path.join(city, date, analysis, "image.tif")
+
     return {"file_path": f"/tiles/{tiff_rel_path}"}
 
 
 @app.get("/get-stats/{city}/{date}/{analysis}")
 async def get_geotiff_stats(city: str, date: str, analysis: str):
     city = city.lower()
-    if city not in cities:
-        raise HTTPException(status_code=400, detail=f"Invalid city name: {city}")
+    check_city(city)
 
-    geojson_rel_path = os.path.join(city, date, analysis, "stats.geojson")
-    geojson_abs_path = os.path.join(TILES_BASE_DIR, geojson_rel_path)
+    stats = stats_index.get(city, date, analysis)
 
-    if not os.path.exists(geojson_abs_path):
+    if stats is None:
         raise HTTPException(status_code=404, detail="GeoJSON file not found.")
 
-    with open(geojson_abs_path) as f:
-        stats_data = geojson.load(f)
+    return {analysis: stats}
+
+
+def first_float(values):
+    try:
+        return float(values[0])
+    except (IndexError, TypeError, ValueError):
+        return float("nan")
+
+
+@app.get("/get-stats/{city}/{analysis}")
+async def get_geotiff_stats_series(
+    city: str,
+    analysis: str,
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    format: str = "json",
+):
+    city = city.lower()
+    check_city(city)
+
+    dates, values = stats_index.series(city, analysis, date_from, date_to)
 
-    stats = [
-        feature['properties'][analysis]
-        for feature in stats_data['features']
-        if analysis in feature['properties']
+    if format == "binary":
+        # Little-endian float32 per week, NaN where a week has no value
+        content = np.array([first_float(v) for v in values], dtype="<f4").tobytes()
+        return Response(
+            content=content,
+            media_type="application/octet-stream",
+            headers={"X-Stats-Dates": ",".join(dates)},
+        )
+
+    if format != "json":
+        raise HTTPException(status_code=400, detail=f"Invalid format: {format}")
+
+    return {"dates": dates, analysis: values}
+
+
+@app.get("/zonal/{city}/{analysis}")
+async def get_zonal_stats(
+    city: str,
+    analysis: str,
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    districts: str = "districts",
+    stats: str = "mean",
+):
+    city = city.lower()
+    check_city(city)
+
+    stats = stats.split(",")
+    unknown = [stat for stat in stats if stat not in zonal_stats]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Invalid stats: {','.join(unknown)}")
+
+    path = districts_path(city, districts)
+    if path is None or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Districts file not found.")
+
+    weeks = [
+        (date, os.path.join(TILES_BASE_DIR, city, date, analysis, "image.tif"), mtime)
+        for date, mtime in catalog.weeks(city, analysis)
+        if (not date_from or date >= date_from) and (not date_to or date <= date_to)
     ]
+    series = await run_in_threadpool(zonal_engine.series, weeks, path, stats)
+    return {"districts": districts, **series}
 
-    return {analysis: stats}
+
+# Declared before the /tiles file route so it is matched first
+@app.get("/tiles/{city}/{date}/{analysis}/{z}/{x}/{y}.png")
+async def get_png_tile(
+    city: str, date: str, analysis: str, z: int, x: int, y: int, palette: str = None
+):
+    city = city.lower()
+    check_city(city)
+
+    palette = palette or analysis
+    if palette not in vis_params:
+        raise HTTPException(status_code=400, detail=f"Invalid palette: {palette}")
+
+    if not is_valid_tile(z, x, y):
+        raise HTTPException(status_code=400, detail=f"Invalid tile: {z}/{x}/{y}")
+
+    analysis_folder = os.path.join(TILES_BASE_DIR, city, date, analysis)
+    tiff_abs_path = os.path.join(analysis_folder, "image.tif")
+
+    mtime = catalog.image_mtime(city, date, analysis)
+    if mtime is None:
+        raise HTTPException(status_code=404, detail="GeoTIFF tile not found.")
+
+    # Pre-built pyramids are served straight from the memory-mapped archive
+    # as long as they are newer than the GeoTIFF they were built from
+    if palette == analysis:
+        archive = open_archive(os.path.join(analysis_folder, ARCHIVE_NAME))
+        if archive is not None and archive.mtime >= mtime:
+            png = archive.get(z, x, y)
+            if png is not None:
+                return Response(content=png, media_type="image/png")
+
+    cache_key = (city, date, analysis, z, x, y, palette)
+    png = tile_cache.get(cache_key, mtime)
+    if png is None:
+        try:
+            png = await run_in_threadpool(render_tile, tiff_abs_path, z, x, y, palette)
+        except RasterioIOError:
+            # Removed or unreadable since the catalog last saw it
+            raise HTTPException(status_code=404, detail="GeoTIFF tile not found.")
+        tile_cache.put(cache_key, mtime, png)
+
+    return Response(content=png, media_type="image/png")
+
+
+def check_preview_request(width, height, dtype):
+    if dtype not in preview_dtypes:
+        raise HTTPException(status_code=400, detail=f"Invalid dtype: {dtype}")
+
+    if not (0 < width <= PREVIEW_MAX_SIZE and 0 < height <= PREVIEW_MAX_SIZE):
+        raise HTTPException(
+            status_code=400,
+            detail=f"width and height must be between 1 and {PREVIEW_MAX_SIZE}",
+        )
+
+
+@app.get("/preview/{city}/{date}/{analysis}")
+async def get_preview(
+    city: str,
+    date: str,
+    analysis: str,
+    width: int = 512,
+    height: int = 512,
+    dtype: str = "float32",
+):
+    city = city.lower()
+    check_city(city)
+    check_preview_request(width, height, dtype)
+
+    mtime = catalog.image_mtime(city, date, analysis)
+    if mtime is None:
+        raise HTTPException(status_code=404, detail="GeoTIFF tile not found.")
+
+    # Shares the tile cache, so replaced images drop their previews too
+    cache_key = (city, date, analysis, "preview", width, height, dtype)
+    content = tile_cache.get(cache_key, mtime)
+    if content is None:
+        tiff_abs_path = os.path.join(TILES_BASE_DIR, city, date, analysis, "image.tif")
+        try:
+            content = await run_in_threadpool(
+                render_preview, tiff_abs_path, width, height, dtype, analysis
+            )
+        except RasterioIOError:
+            raise HTTPException(status_code=404, detail="GeoTIFF tile not found.")
+        tile_cache.put(cache_key, mtime, content)
+
+    return Response(content=content, media_type="application/octet-stream")
+
+
+@app.get("/bundle/{city}/{analysis}")
+async def get_bundle(
+    city: str,
+    analysis: str,
+    request: Request,
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    weeks: int = BUNDLE_MAX_WEEKS,
+    width: int = 512,
+    height: int = 512,
+    dtype: str = "uint8",
+):
+    city = city.lower()
+    check_city(city)
+    check_preview_request(width, height, dtype)
+
+    if not 0 < weeks <= BUNDLE_MAX_WEEKS:
+        raise HTTPException(
+            status_code=400, detail=f"weeks must be between 1 and {BUNDLE_MAX_WEEKS}"
+        )
+
+    # The first `weeks` weeks with an image between from and to
+    selected = [
+        (date, mtime)
+        for date, mtime in catalog.weeks(city, analysis)
+        if (not date_from or date >= date_from) and (not date_to or date <= date_to)
+    ][:weeks]
+    if not selected:
+        raise HTTPException(status_code=404, detail="GeoTIFF tile not found.")
+
+    if width * height * len(selected) > BUNDLE_MAX_PIXELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"width x height x weeks must be at most {BUNDLE_MAX_PIXELS}",
+        )
+
+    dates, mtimes = zip(*selected)
+    cache_key = (city, "bundle", analysis, dates, width, height, dtype)
+    content = tile_cache.get(cache_key, mtimes)
+    if content is None:
+        tiff_abs_paths = [
+            os.path.join(TILES_BASE_DIR, city, date, analysis, "image.tif")
+            for date in dates
+        ]
+        try:
+            content = await run_in_threadpool(
+                render_bundle, tiff_abs_paths, dates, width, height, dtype, analysis
+            )
+        except RasterioIOError:
+            raise HTTPException(status_code=404, detail="GeoTIFF tile not found.")
+        # Quantized weeks are mostly runs of the same values and nodata
+        content = await run_in_threadpool(gzip.compress, content, 6)
+        tile_cache.put(cache_key, mtimes, content)
+
+    headers = {"Vary": "Accept-Encoding"}
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+    else:
+        content = gzip.decompress(content)
+
+    return Response(
+        content=content, media_type="application/octet-stream", headers=headers
+    )
+
+
+@app.get("/get-tile-cache-stats")
+async def get_tile_cache_stats():
+    return tile_cache.stats()
+
+
+@app.api_route("/tiles/{file_path:path}", methods=["GET", "HEAD"])
+async def get_tile_file(file_path: str, request: Request):
+    abs_path = resolve_path(TILES_BASE_DIR, file_path)
+    if not os.path.isfile(abs_path):
+        raise HTTPException(status_code=404, detail="File not found.")
+
+    stat_result = os.stat(abs_path)
+    etag = await run_in_threadpool(file_etag, abs_path, stat_result)
+    # Paths are laid out as <city>/<date>/<analysis>/<file>
+    parts = file_path.split("/")
+    date = parts[1] if len(parts) > 1 else ""
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control_for(date),
+        "Accept-Ranges": "bytes",
+    }
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    media_type = media_types.get(os.path.splitext(abs_path)[1])
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = parse_range(range_header, stat_result.st_size)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat_result.st_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                iter_range(abs_path, start, end),
+                status_code=206,
+                media_type=media_type,
+                headers=headers,
+            )
+
+    return FileResponse(
+        abs_path, media_type=media_type, headers=headers, stat_result=stat_result
+    )
+
+
+app.mount("/static", StaticFiles(directory="static/static"), name="static")
+
+
+# Catch-all for the React app, registered last so it does not shadow the API
+@app.get("/{full_path:path}")
+async def serve_react_app(full_path: str):
+    return FileResponse(Path("static/index.html"))
@@ -0,0 +1,130 @@
+import os
+import glob
+import json
+import time
+import bisect
+import threading
+
+
+def read_stats_file(path, analysis):
+    with open(path) as f:
+        # Older files may hold bare NaN or Infinity tokens, which the API
+        # cannot send back as JSON
+        stats_data = json.load(f, parse_constant=lambda constant: None)
+
+    # Keep only the scalar values the API returns; the city boundary geometry
+    # is dropped here so it is never held in memory or parsed again
+    return [
+        feature["properties"][analysis]
+        for feature in stats_data["features"]
+        if analysis in feature["properties"]
+    ]
+
+
+class StatsIndex:
+    # In-memory index of every <city>/<date>/<analysis>/stats.geojson under
+    # base_dir. Single weeks are a dict lookup, and each (city, analysis) pair
+    # is also kept as two parallel columns, sorted week dates and the stats
+    # values for each week, so requests never touch the filesystem. The tree
+    # is rescanned at most once per refresh_interval seconds and only changed
+    # files are parsed again. A changed file only rebuilds the columns of its
+    # own (city, analysis), and a rescan rebuilds each of those once.
+
+    def __init__(self, base_dir, refresh_interval=30):
+        self.base_dir = base_dir
+        self.refresh_interval = refresh_interval
+        self._files = {}
+        self._values = {}
+        self._weeks = {}
+        self._series = {}
+        self._last_refresh = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        self._last_refresh = time.monotonic()
+        pattern = os.path.join(self.base_dir, "*", "*", "*", "stats.geojson")
+        seen = set()
+        stale = set()
+
+        for path in glob.glob(pattern):
+            seen.add(path)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            cached = self._files.get(path)
+            if cached is not None and cached[0] == mtime:
+                continue
+            stale.add(self.update_file(path, mtime, rebuild=False))
+
+        for path in set(self._files) - seen:
+            stale.add(self.remove_file(path, rebuild=False))
+
+        with self._lock:
+            for city, analysis in stale - {None}:
+                self._rebuild_series(city, analysis)
+        return bool(stale)
+
+    def update_file(self, path, mtime=None, rebuild=True):
+        # Returns the (city, analysis) whose series changed
+        rel_path = os.path.relpath(path, self.base_dir)
+        city, date, analysis, _ = rel_path.split(os.sep)
+        try:
+            mtime = mtime or os.stat(path).st_mtime_ns
+            values = read_stats_file(path, analysis)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Skipping unreadable stats file {path}: {e}")
+            values = None
+
+        city = city.lower()
+        with self._lock:
+            weeks = self._weeks.setdefault((city, analysis), {})
+            if values is None:
+                self._files.pop(path, None)
+                self._values.pop((city, date, analysis), None)
+                weeks.pop(date, None)
+            else:
+                self._files[path] = (mtime, city, date, analysis, values)
+                self._values[(city, date, analysis)] = values
+                weeks[date] = values
+            if rebuild:
+                self._rebuild_series(city, analysis)
+        return city, analysis
+
+    def remove_file(self, path, rebuild=True):
+        with self._lock:
+            entry = self._files.pop(path, None)
+            if entry is None:
+                return None
+            _, city, date, analysis, _ = entry
+            self._values.pop((city, date, analysis), None)
+            self._weeks.get((city, analysis), {}).pop(date, None)
+            if rebuild:
+                self._rebuild_series(city, analysis)
+        return city, analysis
+
+    def maybe_refresh(self):
+        if time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+
+    def get(self, city, date, analysis):
+        self.maybe_refresh()
+        return self._values.get((city, date, analysis))
+
+    def series(self, city, analysis, date_from=None, date_to=None):
+        # Dates are ISO formatted, so the sorted date column can be sliced
+        # by plain string comparison
+        self.maybe_refresh()
+        dates, values = self._series.get((city, analysis), ([], []))
+        start = bisect.bisect_left(dates, date_from) if date_from else 0
+        end = bisect.bisect_right(dates, date_to) if date_to else len(dates)
+        return dates[start:end], values[start:end]
+
+    def _rebuild_series(self, city, analysis):
+        weeks = self._weeks.get((city, analysis))
+        if weeks:
+            dates = sorted(weeks)
+            self._series[(city, analysis)] = (dates, [weeks[date] for date in dates])
+        else:
+            self._weeks.pop((city, analysis), None)
+            self._series.pop((city, analysis), None)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The server modules import each other as top-level modules, and the gee
+# scripts' helpers do the same from inside gee/
+server_folder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [server_folder, os.path.join(server_folder, "gee")]
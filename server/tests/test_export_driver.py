@@ -0,0 +1,77 @@
+import fake_ee
+from export_driver import (
+    ACTIVE_STATES,
+    ExportDriver,
+    export_key,
+    load_completed_exports,
+    resume_exports,
+)
+
+
+def add_exports(driver, batch, descriptions, file_format="GeoTIFF"):
+    for description in descriptions:
+        driver.add(
+            description,
+            lambda description=description: batch.Export.image.toDrive(
+                description=description
+            ),
+            file_format=file_format,
+        )
+
+
+def test_failed_exports_are_retried():
+    batch = fake_ee.FakeBatch(failures={"a": 2, "b": 5})
+    driver = ExportDriver(max_retries=2, sleep=lambda seconds: None)
+    add_exports(driver, batch, ["a", "b", "c"])
+
+    jobs = {job.description: job for job in driver.run()}
+
+    assert jobs["a"].state == "COMPLETED"
+    assert jobs["a"].attempts == 3
+    assert jobs["b"].state == "FAILED"
+    assert jobs["b"].attempts == 3
+    assert jobs["b"].error == "Fake failure"
+    assert jobs["c"].attempts == 1
+    assert driver.summary() == {"COMPLETED": 2, "FAILED": 1}
+
+
+def test_running_exports_never_exceed_max_concurrent():
+    batch = fake_ee.FakeBatch(failures={"export-3": 1})
+    driver = ExportDriver(max_concurrent=3, sleep=lambda seconds: None)
+    add_exports(driver, batch, [f"export-{i}" for i in range(10)])
+
+    running = []
+
+    def sleep(seconds):
+        running.append(sum(job.state in ACTIVE_STATES for job in driver.jobs))
+
+    driver.sleep = sleep
+    driver.run()
+
+    assert max(running) == 3
+    assert all(job.state == "COMPLETED" for job in driver.jobs)
+    assert len(batch.tasks) == 11
+
+
+def test_resume_skips_exports_completed_in_the_manifest(tmp_path):
+    manifest_path = str(tmp_path / "export_manifest.json")
+    batch = fake_ee.FakeBatch(failures={"b": 5})
+    driver = ExportDriver(max_retries=0, sleep=lambda seconds: None)
+    add_exports(driver, batch, ["a", "b"])
+    driver.run()
+    driver.write_manifest(manifest_path)
+
+    completed = resume_exports(manifest_path)
+    assert set(completed) == {export_key("a", "GeoTIFF")}
+    assert load_completed_exports(manifest_path) == {"a"}
+
+    batch = fake_ee.FakeBatch()
+    driver = ExportDriver(sleep=lambda seconds: None, completed=completed)
+    add_exports(driver, batch, ["a", "b"])
+    # Same description, other file format: not the completed export
+    add_exports(driver, batch, ["a"], file_format="GeoJSON")
+    driver.run()
+
+    assert [task.config["description"] for task in batch.tasks] == ["b", "a"]
+    assert driver.jobs[0].to_dict()["skipped"] is True
+    assert driver.summary() == {"COMPLETED": 3}
@@ -0,0 +1,41 @@
+import pytest
+from fastapi import HTTPException
+
+from file_serving import iter_range, parse_range
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=10-", (10, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=-5000", (0, 999)),
+        ("bytes=990-5000", (990, 999)),
+        ("bytes=999-999", (999, 999)),
+        ("bytes=0-1,5-9", None),
+        ("items=0-9", None),
+        ("bytes=a-b", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=1000-1200", "bytes=20-10"])
+def test_unsatisfiable_range_is_416(header):
+    with pytest.raises(HTTPException) as error:
+        parse_range(header, 1000)
+
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */1000"
+
+
+def test_iter_range_reads_the_range_in_chunks(tmp_path):
+    path = tmp_path / "image.tif"
+    path.write_bytes(bytes(range(256)) * 4)
+
+    chunks = list(iter_range(str(path), 10, 209, chunk_size=64))
+
+    assert [len(chunk) for chunk in chunks] == [64, 64, 64, 8]
+    assert b"".join(chunks) == path.read_bytes()[10:210]
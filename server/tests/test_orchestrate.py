@@ -0,0 +1,42 @@
+import datetime
+
+import orchestrate
+from generate_tiles import get_fingerprint, record_fingerprint
+from planner import plan_week_dates
+
+
+def test_plan_cells_reports_the_state_of_every_week(tmp_path, monkeypatch):
+    config = {"end": "2025-03-31", "months": -1}
+    city = {"name": "Riyadh", "clean_name": "riyadh", "analyses": ["lst", "ndvi"]}
+    week_dates = plan_week_dates(datetime.date(2025, 3, 31), -1)
+    # The export scripts found no images for the last ndvi week
+    empty = {"ndvi": [week_dates[3][0]]}
+    monkeypatch.setattr(
+        orchestrate, "load_empty_weeks", lambda city, analysis: empty.get(analysis, [])
+    )
+
+    # First week folder, Sunday 2025-02-23: lst tiled, ndvi only downloaded
+    for analysis in ["lst", "ndvi"]:
+        folder = tmp_path / "riyadh" / "2025-02-23" / analysis
+        folder.mkdir(parents=True)
+        (folder / "image.tif").write_bytes(b"tif")
+    lst_folder = str(tmp_path / "riyadh" / "2025-02-23" / "lst")
+    record_fingerprint(lst_folder, get_fingerprint(f"{lst_folder}/image.tif"))
+
+    # Tiled with --hash, which records a content hash instead of the mtime
+    hashed_folder = tmp_path / "riyadh" / "2025-03-02" / "lst"
+    hashed_folder.mkdir(parents=True)
+    (hashed_folder / "image.tif").write_bytes(b"tif")
+    record_fingerprint(
+        str(hashed_folder), get_fingerprint(str(hashed_folder / "image.tif"), True)
+    )
+
+    cells = orchestrate.plan_cells(config, [city], {"lst", "ndvi"}, str(tmp_path))
+    states = {(cell["analysis"], cell["week"]): cell["state"] for cell in cells}
+
+    assert states[("lst", "2025-02-23")] == orchestrate.TILED
+    assert states[("ndvi", "2025-02-23")] == orchestrate.DOWNLOADED
+    assert states[("lst", "2025-03-02")] == orchestrate.TILED
+    assert states[("ndvi", "2025-03-16")] == orchestrate.EMPTY
+    assert states[("lst", "2025-03-16")] == orchestrate.MISSING
+    assert len(cells) == 2 * len(week_dates)
@@ -0,0 +1,28 @@
+import datetime
+
+import fake_ee
+from planner import build_plan, plan_week_dates
+
+
+def test_plan_week_dates_covers_whole_weeks():
+    weeks = plan_week_dates(datetime.date(2025, 3, 31), -1)
+
+    assert weeks[0] == ("2025-02-28", "2025-03-06")
+    assert len(weeks) == 4
+    assert weeks[-1] == ("2025-03-21", "2025-03-27")
+
+
+def test_build_plan_makes_a_single_getinfo_call():
+    week_dates = plan_week_dates(datetime.date(2025, 3, 31), -1)
+    collections = {
+        "Riyadh": fake_ee.FakeImageCollection(["2025-02-28", "2025-03-02", "2025-03-15"]),
+        "Jiddah": fake_ee.FakeImageCollection([]),
+    }
+    calls = fake_ee.getinfo_calls
+
+    plan = build_plan(fake_ee, week_dates, collections)
+
+    assert fake_ee.getinfo_calls == calls + 1
+    assert [week["count"] for week in plan["Riyadh"]] == [2, 0, 1, 0]
+    assert [week["count"] for week in plan["Jiddah"]] == [0, 0, 0, 0]
+    assert plan["Riyadh"][0] == {"start": "2025-02-28", "end": "2025-03-06", "count": 2}
@@ -0,0 +1,39 @@
+import os
+import json
+
+from stats_index import StatsIndex
+
+
+def write_stats(base_dir, city, date, analysis, value):
+    folder = os.path.join(base_dir, city, date, analysis)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, "stats.geojson")
+    with open(path, "w") as f:
+        json.dump({"features": [{"properties": {analysis: value}}]}, f)
+    return path
+
+
+def test_series_follow_added_changed_and_removed_files(tmp_path):
+    base_dir = str(tmp_path)
+    for i, date in enumerate(["2025-01-19", "2025-01-05", "2025-01-12"]):
+        write_stats(base_dir, "riyadh", date, "uhi", i)
+    write_stats(base_dir, "riyadh", "2025-01-05", "lst", 30)
+    index = StatsIndex(base_dir)
+
+    assert index.refresh()
+    assert index.series("riyadh", "uhi") == (
+        ["2025-01-05", "2025-01-12", "2025-01-19"], [[1], [2], [0]]
+    )
+    assert index.series("riyadh", "uhi", "2025-01-06", "2025-01-19") == (
+        ["2025-01-12", "2025-01-19"], [[2], [0]]
+    )
+
+    index.update_file(write_stats(base_dir, "riyadh", "2025-01-12", "uhi", 5))
+    index.remove_file(os.path.join(base_dir, "riyadh", "2025-01-19", "uhi", "stats.geojson"))
+    assert index.series("riyadh", "uhi") == (["2025-01-05", "2025-01-12"], [[1], [5]])
+    assert index.get("riyadh", "2025-01-05", "lst") == [30]
+
+    os.remove(os.path.join(base_dir, "riyadh", "2025-01-05", "lst", "stats.geojson"))
+    assert index.refresh()
+    assert index.series("riyadh", "lst") == ([], [])
+    assert not index.refresh()
@@ -0,0 +1,35 @@
+from tile_cache import TileCache
+
+
+def test_entries_are_evicted_least_recently_used_first():
+    cache = TileCache(max_bytes=10)
+    cache.put(("riyadh", "2025-01-05", "lst", 1), 1.0, b"aaaa")
+    cache.put(("riyadh", "2025-01-05", "lst", 2), 1.0, b"bbbb")
+    assert cache.get(("riyadh", "2025-01-05", "lst", 1), 1.0) == b"aaaa"
+
+    cache.put(("riyadh", "2025-01-05", "lst", 3), 1.0, b"cccc")
+
+    assert cache.get(("riyadh", "2025-01-05", "lst", 2), 1.0) is None
+    assert cache.get(("riyadh", "2025-01-05", "lst", 1), 1.0) == b"aaaa"
+    assert cache.stats()["bytes"] == 8
+    assert cache.stats()["evictions"] == 1
+
+
+def test_changed_mtime_is_a_miss():
+    cache = TileCache(max_bytes=100)
+    cache.put(("riyadh", "2025-01-05", "lst", 1), 1.0, b"old")
+
+    assert cache.get(("riyadh", "2025-01-05", "lst", 1), 2.0) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_invalidate_matches_none_as_any():
+    cache = TileCache(max_bytes=100)
+    cache.put(("riyadh", "2025-01-05", "lst", 1), 1.0, b"a")
+    cache.put(("riyadh", "2025-01-12", "lst", 1), 1.0, b"b")
+    cache.put(("riyadh", "2025-01-05", "ndvi", 1), 1.0, b"c")
+    cache.put(("jiddah", "2025-01-05", "lst", 1), 1.0, b"d")
+
+    assert cache.invalidate("riyadh", analysis="lst") == 2
+    assert cache.stats()["entries"] == 2
+    assert cache.get(("riyadh", "2025-01-05", "ndvi", 1), 1.0) == b"c"
@@ -0,0 +1,28 @@
+import numpy as np
+
+from uhi import compute_uhi
+
+
+def test_compute_uhi_subtracts_the_other_zone_mean():
+    lst = np.ma.masked_invalid(np.array([[40.0, 42.0], [30.0, np.nan]], dtype=np.float32))
+    urban = np.ma.masked_array(np.array([[True, True], [False, False]]))
+
+    uhi, stats = compute_uhi(lst, urban)
+
+    assert uhi.tolist() == [[10.0, 12.0], [11.0, None]]
+    assert stats["urban_lst"] == 41.0
+    assert stats["rural_lst"] == 30.0
+    assert stats["urban_pixels"] == 2
+    assert stats["rural_pixels"] == 1
+
+
+def test_compute_uhi_without_rural_pixels_has_no_values():
+    lst = np.ma.masked_array(np.array([[40.0, 42.0]], dtype=np.float32))
+    urban = np.ma.masked_array(np.array([[True, True]]))
+
+    uhi, stats = compute_uhi(lst, urban)
+
+    assert uhi.mask.all()
+    assert stats["uhi"] is None
+    assert stats["rural_lst"] is None
+    assert stats["lst"] == 41.0
@@ -0,0 +1,33 @@
+import numpy as np
+
+from zonal import week_stats
+
+
+def test_week_stats_matches_each_zone_computed_alone():
+    rng = np.random.default_rng(0)
+    labels = rng.integers(0, 5, size=200)
+    # Zone 3 has no pixels and zone 4 only nodata
+    labels[labels == 3] = 0
+    values = rng.normal(30, 5, size=200).astype(np.float32)
+    values[labels == 4] = np.nan
+    values[::7] = np.nan
+
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=5)
+    order = order[counts[0]:]
+    offsets = np.concatenate([[0], np.cumsum(counts[1:])])
+
+    result = week_stats(values, order, offsets, ["count", "mean", "min", "max", "p50"])
+
+    for zone in range(4):
+        zone_values = values[labels == zone + 1]
+        zone_values = zone_values[np.isfinite(zone_values)]
+        assert result["count"][zone] == zone_values.size
+        if zone_values.size:
+            assert np.isclose(result["mean"][zone], zone_values.mean())
+            assert result["min"][zone] == zone_values.min()
+            assert result["max"][zone] == zone_values.max()
+            assert np.isclose(result["p50"][zone], np.percentile(zone_values, 50))
+        else:
+            assert result["mean"][zone] is None
+            assert result["p50"][zone] is None
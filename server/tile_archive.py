@@ -0,0 +1,121 @@
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+
+# Single-file tile archive, one per <city>/<week>/<analysis> pyramid:
+#
+#   header     magic, version, tile count, directory offset
+#   tile data  PNG blobs, identical tiles stored once
+#   directory  (key, offset, length) records sorted by key
+#
+# where key packs z/x/y (XYZ numbering) into one integer, so a lookup is a
+# binary search over a memory-mapped array.
+
+ARCHIVE_NAME = "tiles.archive"
+MAGIC = b"UHMTILES"
+VERSION = 1
+HEADER = struct.Struct("<8sIIQ")
+DIRECTORY_DTYPE = np.dtype([("key", "<u8"), ("offset", "<u8"), ("length", "<u4")])
+
+
+def tile_key(z, x, y):
+    return (z << 58) | (x << 29) | y
+
+
+class TileArchiveWriter:
+    def __init__(self, path):
+        self.path = path
+        # A temporary file of its own, as two runs may tile the same folder
+        fd, self._tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path) or ".", suffix=".tmp"
+        )
+        self._file = os.fdopen(fd, "wb")
+        self._file.write(b"\0" * HEADER.size)
+        self._entries = []
+        self._blobs = {}
+
+    def add(self, z, x, y, content):
+        digest = hashlib.sha1(content).digest()
+        if digest in self._blobs:
+            offset = self._blobs[digest]
+        else:
+            offset = self._file.tell()
+            self._file.write(content)
+            self._blobs[digest] = offset
+        self._entries.append((tile_key(z, x, y), offset, len(content)))
+
+    def close(self):
+        directory = np.array(sorted(self._entries), dtype=DIRECTORY_DTYPE)
+        directory_offset = self._file.tell()
+        self._file.write(directory.tobytes())
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, len(directory), directory_offset))
+        self._file.close()
+        # Renamed into place so the server never maps a half-written archive
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class TileArchive:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.mtime = os.fstat(f.fileno()).st_mtime_ns
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, count, directory_offset = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a tile archive")
+        self._directory = np.frombuffer(
+            self._mm, dtype=DIRECTORY_DTYPE, count=count, offset=directory_offset
+        )
+
+    def __len__(self):
+        return len(self._directory)
+
+    def get(self, z, x, y):
+        # np.uint64 keeps the comparison exact; a Python int would be
+        # compared as float64 and lose the low bits
+        key = np.uint64(tile_key(z, x, y))
+        index = np.searchsorted(self._directory["key"], key)
+        if index == len(self._directory) or self._directory["key"][index] != key:
+            return None
+        entry = self._directory[index]
+        offset = int(entry["offset"])
+        return self._mm[offset : offset + int(entry["length"])]
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def open_archive(path):
+    # Archives stay mapped between requests and are reopened when replaced
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    with _archives_lock:
+        cached = _archives.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        archive = TileArchive(path)
+        _archives[path] = (mtime, archive)
+        return archive
@@ -0,0 +1,81 @@
+import threading
+from collections import OrderedDict
+
+
+class TileCache:
+    # In-process LRU cache of rendered tiles bounded by the total size of the
+    # cached bytes. Every entry remembers the mtime of the image.tif it was
+    # rendered from, so a file replaced by download.py is never served stale.
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, mtime):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] != mtime:
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, mtime, content):
+        size = len(content)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (mtime, content)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, city, date=None, analysis=None):
+        # Keys start with (city, date, analysis, ...); None matches anything
+        wanted = (city, date, analysis)
+        with self._lock:
+            stale = [
+                key
+                for key in self._entries
+                if all(w is None or w == k for w, k in zip(wanted, key))
+            ]
+            for key in stale:
+                self._remove(key)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        _, content = self._entries.pop(key)
+        self.current_bytes -= len(content)
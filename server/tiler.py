@@ -0,0 +1,90 @@
+import warnings
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.enums import Resampling
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.io import MemoryFile
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+
+from palettes import categorical, get_lut, vis_params
+
+TILE_SIZE = 256
+WEB_MERCATOR = CRS.from_epsg(3857)
+# Half the circumference of the earth in web mercator meters
+ORIGIN_SHIFT = 20037508.342789244
+
+
+def tile_bounds(z, x, y):
+    tile_span = 2 * ORIGIN_SHIFT / (2**z)
+    west = -ORIGIN_SHIFT + x * tile_span
+    north = ORIGIN_SHIFT - y * tile_span
+    return west, north - tile_span, west + tile_span, north
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= 24 and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def colorize(data, valid, palette_name):
+    params = vis_params[palette_name]
+    scaled = (data - params["min"]) / (params["max"] - params["min"]) * 255
+    indexes = np.clip(np.nan_to_num(scaled), 0, 255).astype("uint8")
+    rgba = get_lut(palette_name)[indexes]
+    rgba[..., 3] = np.where(valid, 255, 0)
+    return rgba
+
+
+def encode_png(rgba):
+    height, width = rgba.shape[:2]
+    with warnings.catch_warnings(), MemoryFile() as memfile:
+        # Tiles are placed by their z/x/y address, not by a geotransform
+        warnings.simplefilter("ignore", NotGeoreferencedWarning)
+        with memfile.open(
+            driver="PNG", width=width, height=height, count=4, dtype="uint8"
+        ) as dst:
+            dst.write(np.moveaxis(rgba, -1, 0))
+        return memfile.read()
+
+
+def empty_tile():
+    return encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype="uint8"))
+
+
+def read_tile(src, z, x, y, resampling):
+    # Warp only the tile footprint; GDAL reads just the source blocks that
+    # intersect it instead of the whole raster
+    west, south, east, north = tile_bounds(z, x, y)
+    left, bottom, right, top = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds)
+    if west >= right or east <= left or south >= top or north <= bottom:
+        return None, None
+
+    with WarpedVRT(
+        src,
+        crs=WEB_MERCATOR,
+        transform=from_bounds(west, south, east, north, TILE_SIZE, TILE_SIZE),
+        width=TILE_SIZE,
+        height=TILE_SIZE,
+        resampling=resampling,
+        add_alpha=True,
+    ) as vrt:
+        data = vrt.read(1, out_dtype="float32")
+        alpha = vrt.read(vrt.count)
+    return data, (alpha > 0) & ~np.isnan(data)
+
+
+def render_tile(tif_path, z, x, y, palette_name):
+    if palette_name in categorical:
+        resampling = Resampling.nearest
+    else:
+        resampling = Resampling.bilinear
+
+    with rasterio.open(tif_path) as src:
+        data, valid = read_tile(src, z, x, y, resampling)
+
+    if data is None or not valid.any():
+        return empty_tile()
+    return encode_png(colorize(data, valid, palette_name))
@@ -0,0 +1,227 @@
+import os
+import glob
+import json
+import argparse
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.errors import RasterioIOError
+from rasterio.transform import array_bounds
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import transform_bounds
+from dotenv import load_dotenv
+
+from cog import convert_to_cog
+
+# Local version of export_lst_and_uhi in gee/lst.py. Given the lst and um
+# images of a week it writes uhi/image.tif and uhi/stats.geojson, so only LST
+# and the urban mask have to be exported from Earth Engine, e.g.
+#
+#     python uhi.py --city riyadh
+#
+# Urban pixels get their LST minus the rural mean and rural pixels the urban
+# mean minus their LST, as urban_lst.subtract(nonurban_lst) does in the script.
+# Pixels without an LST value are left empty rather than filled with the
+# difference of the means, since the exported images no longer carry the
+# city boundary that tells them apart from pixels outside the city.
+
+load_dotenv()
+
+data_folder = os.getenv("DATAPATH", "data")
+
+URBAN, RURAL = 1, 2
+
+
+def read_lst(path):
+    with rasterio.open(path) as src:
+        lst = np.ma.masked_invalid(src.read(1, masked=True).astype(np.float32))
+        profile = {
+            "crs": src.crs,
+            "transform": src.transform,
+            "width": src.width,
+            "height": src.height,
+        }
+    return lst, profile
+
+
+def read_urban_mask(path, grid, threshold=None):
+    # The urban mask on the LST grid. With a threshold the image is the night
+    # light radiance exported with UM_EXPORT_RADIANCE=1 rather than the
+    # thresholded um mask.
+    with rasterio.open(path) as src, \
+            WarpedVRT(src, resampling=Resampling.nearest, **grid) as vrt:
+        values = vrt.read(1, masked=True)
+    if threshold is None:
+        return values.astype(bool)
+    return values > threshold
+
+
+def compute_uhi(lst, urban):
+    # lst and urban are masked arrays on the same grid. Returns the UHI image
+    # as a masked array and the zonal statistics of the week.
+    valid = ~np.ma.getmaskarray(lst) & ~np.ma.getmaskarray(urban)
+    zones = np.where(valid, np.where(urban.filled(False), URBAN, RURAL), 0)
+
+    # Sums and pixel counts of both zones in one pass
+    lst_values = lst.filled(0).astype(np.float64)
+    counts = np.bincount(zones.ravel(), minlength=3)
+    sums = np.bincount(zones.ravel(), weights=lst_values.ravel(), minlength=3)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = sums / counts
+    urban_mean, rural_mean = means[URBAN], means[RURAL]
+
+    uhi = np.where(zones == URBAN, lst_values - rural_mean, urban_mean - lst_values)
+    # A zone's UHI needs the mean of the other zone; a week without urban or
+    # without rural pixels leaves the other zone empty instead of NaN
+    uhi_valid = valid & np.isfinite(uhi)
+    uhi = np.ma.masked_array(uhi.astype(np.float32), mask=~uhi_valid)
+
+    lst_count = counts[URBAN] + counts[RURAL]
+    stats = {
+        "uhi": float(uhi.mean()) if uhi_valid.any() else None,
+        "lst": float((sums[URBAN] + sums[RURAL]) / lst_count) if lst_count else None,
+        "urban_lst": float(urban_mean) if counts[URBAN] else None,
+        "rural_lst": float(rural_mean) if counts[RURAL] else None,
+        "urban_pixels": int(counts[URBAN]),
+        "rural_pixels": int(counts[RURAL]),
+    }
+    return uhi, stats
+
+
+def finite_or_none(value):
+    # NaN and infinities are not valid JSON
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def write_image(uhi, grid, destination):
+    tmp_path = f"{destination}.uhi.tmp"
+    profile = {
+        "driver": "GTiff",
+        "dtype": "float32",
+        "count": 1,
+        "nodata": np.nan,
+        **grid,
+    }
+    try:
+        with rasterio.open(tmp_path, "w", **profile) as dst:
+            dst.write(uhi.filled(np.nan), 1)
+        convert_to_cog(tmp_path, destination)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_stats(stats, grid, city, destination):
+    west, south, east, north = transform_bounds(
+        grid["crs"],
+        "EPSG:4326",
+        *array_bounds(grid["height"], grid["width"], grid["transform"]),
+    )
+    feature = {
+        "type": "Feature",
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [[
+                [west, south], [east, south], [east, north], [west, north], [west, south]
+            ]],
+        },
+        "properties": {
+            "city": city,
+            **{name: finite_or_none(value) for name, value in stats.items()},
+        },
+    }
+    tmp_path = f"{destination}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {"type": "FeatureCollection", "features": [feature]},
+            f,
+            indent=2,
+            allow_nan=False,
+        )
+    os.replace(tmp_path, destination)
+
+
+def is_up_to_date(outputs, inputs):
+    if not all(os.path.exists(path) for path in outputs):
+        return False
+    newest_input = max(os.path.getmtime(path) for path in inputs)
+    return min(os.path.getmtime(path) for path in outputs) >= newest_input
+
+
+def recorded_threshold(stats_path):
+    try:
+        with open(stats_path) as f:
+            return json.load(f)["features"][0]["properties"].get("threshold")
+    except (OSError, ValueError, KeyError, IndexError):
+        return None
+
+
+def build_uhi_for_week(date_folder, city, threshold=None, force=False):
+    # Without a threshold the urban pixels come from the um mask, with one
+    # from the radiance image, so the threshold can be tuned without
+    # exporting again
+    lst_path = os.path.join(date_folder, "lst", "image.tif")
+    mask_folder = "um" if threshold is None else "radiance"
+    um_path = os.path.join(date_folder, mask_folder, "image.tif")
+    uhi_folder = os.path.join(date_folder, "uhi")
+    image_path = os.path.join(uhi_folder, "image.tif")
+    stats_path = os.path.join(uhi_folder, "stats.geojson")
+
+    if not (os.path.exists(lst_path) and os.path.exists(um_path)):
+        return None
+    if (
+        not force
+        and is_up_to_date([image_path, stats_path], [lst_path, um_path])
+        and recorded_threshold(stats_path) == threshold
+    ):
+        return None
+
+    lst, grid = read_lst(lst_path)
+    urban = read_urban_mask(um_path, grid, threshold)
+    uhi, stats = compute_uhi(lst, urban)
+    stats["threshold"] = threshold
+
+    os.makedirs(uhi_folder, exist_ok=True)
+    write_image(uhi, grid, image_path)
+    write_stats(stats, grid, city, stats_path)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compute UHI images and stats from the lst and um images."
+    )
+    parser.add_argument("--city", required=True, help="City folder name, e.g. riyadh.")
+    parser.add_argument(
+        "--date",
+        type=str,
+        default=None,
+        help="Only process this week folder (YYYY-MM-DD).",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=None,
+        help="Night light radiance above which a pixel is urban, read from "
+        "the radiance images exported with UM_EXPORT_RADIANCE=1 instead of "
+        "the um mask.",
+    )
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("--folder", type=str, default=data_folder)
+    args = parser.parse_args()
+
+    city_folder = os.path.join(args.folder, args.city)
+    for date_folder in sorted(glob.glob(os.path.join(city_folder, args.date or "*"))):
+        try:
+            stats = build_uhi_for_week(date_folder, args.city, args.threshold, args.force)
+        except RasterioIOError as e:
+            print(f"Failed to compute UHI for {date_folder}: {e}")
+            continue
+        if stats is not None:
+            print(f"UHI for {date_folder}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
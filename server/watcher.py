@@ -0,0 +1,235 @@
+import os
+import glob
+import ctypes
+import ctypes.util
+import select
+import struct
+import threading
+
+# Watches the <city>/<date>/<analysis>/ folders of the data tree for new,
+# replaced and removed image.tif and stats.geojson files, and reports each
+# one to on_change(path, removed). download.py, cog.py and uhi.py move
+# finished files into place with os.replace, which shows up as a single
+# rename event, so callers never see a half-written file.
+#
+# On Linux the tree is watched with inotify; elsewhere, or when inotify is
+# not available, it is rescanned every poll_interval seconds. When events may
+# have been lost (queue overflow, a whole folder moved away) on_rescan() is
+# called so the caller can rebuild its state from a full scan.
+
+watched_names = {"image.tif", "stats.geojson"}
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+# Folder levels below the base directory: city, date, analysis
+MAX_DEPTH = 3
+
+
+def load_libc():
+    # libc with the inotify calls, or None where they do not exist
+    path = ctypes.util.find_library("c")
+    if path is None:
+        return None
+    try:
+        libc = ctypes.CDLL(path, use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+def find_watched_files(folder):
+    files = []
+    for name in watched_names:
+        files.extend(glob.glob(os.path.join(folder, "**", name), recursive=True))
+    return files
+
+
+class TreeWatcher:
+    def __init__(self, base_dir, on_change, on_rescan, mode="auto", poll_interval=5):
+        # Kept as given so reported paths match the ones the indexes glob
+        self.base_dir = base_dir
+        self.on_change = on_change
+        self.on_rescan = on_rescan
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.backend = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._fd = None
+        self._libc = None
+        self._watches = {}
+        self._mtimes = {}
+
+    def start(self):
+        if self.mode in ("auto", "inotify"):
+            self._libc = load_libc()
+            if self._libc is not None:
+                self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+                if self._fd < 0:
+                    self._fd = None
+            if self._fd is None and self.mode == "inotify":
+                raise OSError("inotify is not available")
+
+        if self._fd is not None:
+            self.backend = "inotify"
+            # The caller has just scanned the tree, only later changes matter
+            self._watch_tree(self.base_dir, report=False)
+            target = self._run_inotify
+        else:
+            self.backend = "poll"
+            self._mtimes = self._scan()
+            target = self._run_polling
+
+        self._thread = threading.Thread(target=target, name="tree-watcher", daemon=True)
+        self._thread.start()
+        print(f"Watching {self.base_dir} for changes ({self.backend})")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _notify(self, path, removed):
+        try:
+            self.on_change(path, removed)
+        except Exception as e:
+            # A bad file must not stop the watcher
+            print(f"Failed to apply change to {path}: {e}")
+
+    def _depth(self, path):
+        rel_path = os.path.relpath(path, self.base_dir)
+        return 0 if rel_path == "." else len(rel_path.split(os.sep))
+
+    # Polling backend
+
+    def _scan(self):
+        mtimes = {}
+        for path in find_watched_files(self.base_dir):
+            if self._depth(path) != MAX_DEPTH + 1:
+                continue
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+        return mtimes
+
+    def _run_polling(self):
+        while not self._stop.wait(self.poll_interval):
+            mtimes = self._scan()
+            for path, mtime in mtimes.items():
+                if self._mtimes.get(path) != mtime:
+                    self._notify(path, False)
+            for path in set(self._mtimes) - set(mtimes):
+                self._notify(path, True)
+            self._mtimes = mtimes
+
+    # inotify backend
+
+    def _add_watch(self, folder):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), WATCH_MASK)
+        if wd < 0:
+            print(f"Could not watch {folder}: errno {ctypes.get_errno()}")
+            return
+        self._watches[wd] = folder
+
+    def _watch_tree(self, folder, report=True):
+        # Watch a folder and its subfolders down to the analysis level. Files
+        # written before the watch was in place are reported as changes.
+        depth = self._depth(folder)
+        if depth > MAX_DEPTH:
+            return
+        self._add_watch(folder)
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                self._watch_tree(entry.path, report)
+            elif report and depth == MAX_DEPTH and entry.name in watched_names:
+                self._notify(entry.path, False)
+
+    def _read_events(self):
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            yield wd, mask, os.fsdecode(name)
+
+    def _run_inotify(self):
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self._fd], [], [], 1.0)
+            if not ready:
+                continue
+            rescan = False
+            for wd, mask, name in self._read_events():
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                folder = self._watches.get(wd)
+                if folder is None:
+                    continue
+
+                path = os.path.join(folder, name) if name else folder
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self._watch_tree(path)
+                    elif mask & IN_MOVED_FROM:
+                        # Its files are gone without a delete event each
+                        rescan = True
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    self._watches.pop(wd, None)
+                    if mask & IN_MOVE_SELF:
+                        rescan = True
+                    continue
+
+                if name not in watched_names or self._depth(folder) != MAX_DEPTH:
+                    continue
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._notify(path, True)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self._notify(path, False)
+
+            if rescan:
+                self._rescan()
+
+    def _rescan(self):
+        for folder in list(self._watches.values()):
+            if not os.path.isdir(folder):
+                self._watches = {
+                    wd: watched for wd, watched in self._watches.items() if watched != folder
+                }
+        try:
+            self.on_rescan()
+        except Exception as e:
+            print(f"Failed to rescan {self.base_dir}: {e}")
@@ -0,0 +1,271 @@
+import os
+import re
+import glob
+import json
+import hashlib
+import argparse
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from rasterio.errors import RasterioIOError
+from rasterio.features import rasterize
+from rasterio.warp import transform_geom
+from dotenv import load_dotenv
+
+# Zonal statistics of the weekly images over districts, neighbourhoods or
+# any other polygons, e.g. the mean LST of every district of a city:
+#
+#     python zonal.py --city riyadh --analysis lst --stats mean p50
+#
+# Districts are GeoJSON files at <districts folder>/<city>/<name>.geojson,
+# each feature one zone named by its DISTRICT_NAME_PROPERTY. For every grid
+# the images come in, the polygons are rasterized once into an index of the
+# pixels of each zone, sorted by zone, and cached on disk. A week then only
+# gathers its pixels in that order and reduces all zones at once, and its
+# result is kept in memory until the image changes.
+
+load_dotenv()
+
+data_folder = os.getenv("DATAPATH", "data")
+districts_folder = os.getenv("DISTRICTS_DIR", os.path.join(data_folder, "districts"))
+index_folder = os.getenv("ZONAL_INDEX_DIR", os.path.join(districts_folder, ".index"))
+name_property = os.getenv("DISTRICT_NAME_PROPERTY", "name")
+cached_weeks = int(os.getenv("ZONAL_CACHE_WEEKS", 1024))
+
+percentiles = [10, 25, 50, 75, 90]
+zonal_stats = ["count", "mean", "min", "max", *(f"p{q}" for q in percentiles)]
+
+valid_name = re.compile(r"^[\w-]+$")
+
+
+def districts_path(city, districts, folder=districts_folder):
+    # Path of a districts file, or None for names that are not plain words
+    if not valid_name.match(city) or not valid_name.match(districts):
+        return None
+    return os.path.join(folder, city, f"{districts}.geojson")
+
+
+def load_districts(path):
+    # (zone names, geometries in EPSG:4326) of the features of a GeoJSON file
+    with open(path) as f:
+        features = json.load(f)["features"]
+    names = []
+    geometries = []
+    for i, feature in enumerate(features):
+        if not feature.get("geometry"):
+            continue
+        properties = feature.get("properties") or {}
+        names.append(str(properties.get(name_property, feature.get("id", i))))
+        geometries.append(feature["geometry"])
+    return names, geometries
+
+
+def build_index(geometries, crs, transform, shape):
+    # (order, offsets): the flat indexes of the pixels inside a zone sorted
+    # by zone, and where the pixels of every zone start. Where polygons
+    # overlap the later feature wins.
+    shapes = [
+        (transform_geom("EPSG:4326", crs, geometry), zone + 1)
+        for zone, geometry in enumerate(geometries)
+    ]
+    labels = rasterize(
+        shapes, out_shape=shape, transform=transform, fill=0, dtype="int32"
+    ).ravel()
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=len(geometries) + 1)
+    order = order[counts[0]:].astype(np.uint32 if labels.size < 2**32 else np.int64)
+    offsets = np.concatenate([[0], np.cumsum(counts[1:])])
+    return order, offsets
+
+
+def week_stats(values, order, offsets, stats=zonal_stats):
+    # {stat: [value per zone]} of a flat array of pixel values, NaN where
+    # nodata; zones without valid pixels get None. The pixels of every zone
+    # are contiguous once gathered in index order, so each statistic is one
+    # reduceat over all zones. Empty zones are left out of the reduceat, so
+    # that every segment is exactly one zone.
+    zone_count = len(offsets) - 1
+    values = values[order]
+    valid = np.isfinite(values)
+    filled = np.flatnonzero(np.diff(offsets))
+    starts = offsets[filled]
+
+    count = np.zeros(zone_count, dtype=np.int64)
+    total = np.zeros(zone_count)
+    low = np.full(zone_count, np.nan)
+    high = np.full(zone_count, np.nan)
+    if filled.size:
+        count[filled] = np.add.reduceat(valid, starts, dtype=np.int64)
+        total[filled] = np.add.reduceat(
+            np.where(valid, values, 0), starts, dtype=np.float64
+        )
+        # fmin and fmax skip NaN
+        low[filled] = np.fmin.reduceat(values, starts)
+        high[filled] = np.fmax.reduceat(values, starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+
+    result = {"count": count.tolist()}
+    columns = {"mean": mean, "min": low, "max": high}
+    wanted = [q for q in percentiles if f"p{q}" in stats]
+    if wanted:
+        quantiles = np.full((len(wanted), zone_count), np.nan)
+        for zone in np.flatnonzero(count):
+            segment = values[offsets[zone]:offsets[zone + 1]]
+            quantiles[:, zone] = np.percentile(segment[np.isfinite(segment)], wanted)
+        columns.update((f"p{q}", zone_values) for q, zone_values in zip(wanted, quantiles))
+
+    for stat, zone_values in columns.items():
+        if stat in stats:
+            result[stat] = [None if np.isnan(v) else float(v) for v in zone_values]
+    return result
+
+
+def read_values(path):
+    # Flat float32 values of the first band with NaN where nodata, and the
+    # grid they are on
+    with rasterio.open(path) as src:
+        values = src.read(1, masked=True).astype(np.float32).filled(np.nan)
+        grid = (src.crs, src.transform, (src.height, src.width))
+    return values.ravel(), grid
+
+
+class ZonalEngine:
+    # Caches the pixel index of every districts file and grid, in memory and
+    # under index_dir, and the statistics of every week and districts file
+    # by image mtime.
+
+    def __init__(self, index_dir=index_folder, max_weeks=cached_weeks):
+        self.index_dir = index_dir
+        self.max_weeks = max_weeks
+        self._districts = {}
+        self._indexes = {}
+        self._weeks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def districts(self, path):
+        # (names, geometries, fingerprint) of a districts file, reloaded when
+        # its mtime changes
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._districts.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(path, "rb") as f:
+                fingerprint = hashlib.sha1(f.read()).hexdigest()
+            names, geometries = load_districts(path)
+            cached = (mtime, names, geometries, fingerprint)
+            self._districts[path] = cached
+        return cached[1:]
+
+    def index(self, path, grid):
+        names, geometries, fingerprint = self.districts(path)
+        crs, transform, shape = grid
+        key = hashlib.sha1(
+            json.dumps([fingerprint, crs.to_string(), list(transform)[:6], shape]).encode()
+        ).hexdigest()
+
+        index = self._indexes.get(key)
+        if index is not None:
+            return names, index
+
+        index_path = os.path.join(self.index_dir, f"{key}.npz")
+        if os.path.exists(index_path):
+            with np.load(index_path) as cached:
+                index = (cached["order"], cached["offsets"])
+        else:
+            index = build_index(geometries, crs, transform, shape)
+            os.makedirs(self.index_dir, exist_ok=True)
+            # A temporary file of its own, as concurrent requests may build
+            # the same index
+            fd, tmp_path = tempfile.mkstemp(dir=self.index_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, order=index[0], offsets=index[1])
+                os.replace(tmp_path, index_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            print(f"Indexed {len(names)} zones of {path} at {index_path}")
+
+        with self._lock:
+            self._indexes[key] = index
+        return names, index
+
+    def week(self, tif_path, mtime, path, stats=zonal_stats):
+        # (zone names, {stat: [value per zone]}) of one image
+        stats = tuple(sorted(stats))
+        key = (tif_path, mtime, path, stats)
+        with self._lock:
+            cached = self._weeks.get(key)
+            if cached is not None:
+                self._weeks.move_to_end(key)
+                return cached
+
+        values, grid = read_values(tif_path)
+        names, index = self.index(path, grid)
+        result = (names, week_stats(values, *index, stats))
+
+        with self._lock:
+            self._weeks[key] = result
+            while len(self._weeks) > self.max_weeks:
+                self._weeks.popitem(last=False)
+        return result
+
+    def series(self, weeks, path, stats=("mean",)):
+        # weeks is [(date, image path, mtime)]. Returns {"zones", "dates",
+        # stat: [[value per zone] per date]}, leaving out unreadable images.
+        result = {"zones": [], "dates": []}
+        for stat in stats:
+            result[stat] = []
+        for date, tif_path, mtime in weeks:
+            try:
+                names, week = self.week(tif_path, mtime, path, stats)
+            except RasterioIOError as e:
+                print(f"Skipping {tif_path} in zonal stats: {e}")
+                continue
+            result["zones"] = names
+            result["dates"].append(date)
+            for stat in stats:
+                result[stat].append(week[stat])
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compute statistics of every week over the zones of a districts file."
+    )
+    parser.add_argument("--city", required=True, help="City folder name, e.g. riyadh.")
+    parser.add_argument("--analysis", required=True)
+    parser.add_argument(
+        "--districts",
+        type=str,
+        default="districts",
+        help="Name of the districts file in the city's districts folder.",
+    )
+    parser.add_argument("--stats", nargs="+", choices=zonal_stats, default=["mean"])
+    parser.add_argument("--folder", type=str, default=data_folder)
+    parser.add_argument("--districts-folder", type=str, default=districts_folder)
+    args = parser.parse_args()
+
+    path = districts_path(args.city, args.districts, args.districts_folder)
+    if path is None or not os.path.exists(path):
+        parser.error(f"No districts file {args.districts} for {args.city}")
+
+    pattern = os.path.join(args.folder, args.city, "*", args.analysis, "image.tif")
+    weeks = [
+        (os.path.basename(os.path.dirname(os.path.dirname(tif_path))), tif_path, None)
+        for tif_path in sorted(glob.glob(pattern))
+    ]
+    series = ZonalEngine().series(weeks, path, args.stats)
+
+    for stat in args.stats:
+        print(f"{stat}:")
+        print("\t".join(["date", *series["zones"]]))
+        for date, zone_values in zip(series["dates"], series[stat]):
+            print("\t".join([date, *("" if v is None else f"{v:.4g}" for v in zone_values)]))
+
+
+if __name__ == "__main__":
+    main()